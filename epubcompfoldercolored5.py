@@ -1,71 +1,2242 @@
 from colorama import Fore, Style, init
 from tqdm import tqdm
+import io
+import re
+import html
+import json
+import struct
+import hashlib
+import zlib
 import zipfile
 import os
+import posixpath
+import urllib.parse
 import shutil
+import tempfile
+import subprocess
 import argparse
-from PIL import Image
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import PIL
+from PIL import Image, ImageCms, features
+
+# Backend deflate alternativi, opzionali
+try:
+    from zlib_ng import zlib_ng
+except ImportError:
+    zlib_ng = None
+try:
+    from isal import isal_zlib
+except ImportError:
+    isal_zlib = None
+try:
+    import zopfli.zopfli
+except ImportError:
+    zopfli = None
+
+# fontTools, opzionale, per la riduzione dei font incorporati
+try:
+    from fontTools import subset as font_subset
+    from fontTools.ttLib import TTFont
+except ImportError:
+    font_subset = None
 
 # Inizializza Colorama
 init(autoreset=True)
 
-def compress_image(image_path, quality=70):
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Membri testuali che possono contenere riferimenti ad altri membri dell'EPUB
+TEXT_EXTENSIONS = ('.opf', '.xhtml', '.html', '.htm', '.ncx', '.svg', '.smil', '.css')
+
+# Media type delle immagini, per aggiornare il manifest dopo una conversione
+MEDIA_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.avif': 'image/avif',
+}
+
+# Riferimenti nei documenti: attributi XHTML/OPF/NCX/SVG e url() dei CSS
+ATTRIBUTE_URL_RE = re.compile(r"""(\b(?:src|href|xlink:href|poster|data)\s*=\s*)(["'])(.*?)\2""", re.I | re.S)
+CSS_URL_RE = re.compile(r"""(url\(\s*)(["']?)([^"')]*?)\2(\s*\))""", re.I | re.S)
+MANIFEST_ITEM_RE = re.compile(r"<(?:opf:)?item\b[^>]*>", re.I | re.S)
+HREF_RE = re.compile(r"""(\bhref\s*=\s*)(["'])(.*?)\2""", re.I | re.S)
+MEDIA_TYPE_RE = re.compile(r"""(\bmedia-type\s*=\s*)(["'])(.*?)\2""", re.I | re.S)
+URL_SAFE_CHARS = "/-_.~!$&'()*+,;=:@"
+
+# Font incorporati: estensioni, caratteri sempre mantenuti (spazi, trattini della
+# sillabazione, numeri e punti degli elenchi) e regole CSS che li riguardano
+FONT_EXTENSIONS = ('.ttf', '.otf', '.woff', '.woff2')
+FONT_EXTRA_TEXT = " \u00a0\u00ad-\u2010\u2011.0123456789\u2022\u25e6\u25aa"
+FONT_FACE_RE = re.compile(r"@font-face\s*\{([^}]*)\}", re.I)
+FONT_FAMILY_RE = re.compile(r"""\bfont-family\s*:\s*(["']?)([^;}"']+)\1""", re.I)
+FONT_DECLARATION_RE = re.compile(r"(?<![-\w])font(?:-family)?\s*:([^;}]*)", re.I)
+CSS_CONTENT_RE = re.compile(r"""\bcontent\s*:\s*(["'])(.*?)\1""", re.I | re.S)
+CSS_ESCAPE_RE = re.compile(r"\\(?:([0-9a-fA-F]{1,6})\s?|(.))", re.S)
+CSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.S)
+CSS_IMPORT_RE = re.compile(r"""@import\s+(?:url\(\s*)?(["']?)([^"')\s;]+)\1""", re.I)
+STYLE_BLOCK_RE = re.compile(r"<style\b[^>]*>(.*?)</style\s*>", re.I | re.S)
+STYLE_ATTRIBUTE_RE = re.compile(r"""\bstyle\s*=\s*(["'])(.*?)\1""", re.I | re.S)
+NON_TEXT_RE = re.compile(r"<(script|style)\b.*?</\1\s*>|<!--.*?-->|<[^>]*>", re.I | re.S)
+
+# Minificazione di XHTML e CSS: membri trattati, elementi il cui contenuto resta
+# invariato (o, per style, viene minificato come CSS) e lessico usato
+MINIFY_EXTENSIONS = ('.xhtml', '.html', '.htm', '.css')
+MARKUP_RE = re.compile(
+    r"""<(script|style|pre|textarea)\b((?:[^>"'/]|"[^"]*"|'[^']*'|/(?!>))*)>(.*?)</\1\s*>"""
+    r"""|<!--.*?-->|<!\[CDATA\[.*?\]\]>|<(?:[^>"']|"[^"]*"|'[^']*')*>""", re.I | re.S)
+TAG_SPACE_RE = re.compile(r"""("[^"]*"|'[^']*')|\s+""")
+TEXT_SPACE_RE = re.compile(r"[ \t\r\n]+")
+CSS_TOKEN_RE = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|/\*.*?\*/""", re.S)
+CSS_RULE_RE = re.compile(r"([^{}]*)\{([^{}]*)\}")
+CSS_DECLARATION_RE = re.compile(r"""(?:"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|\([^()]*\)|[^;"'(])+""")
+WHITE_SPACE_PRE_RE = re.compile(r"white-space\s*:\s*(?:pre|break-spaces)", re.I)
+XML_SPACE_PRESERVE_RE = re.compile(r"""\sxml:space\s*=\s*(["'])preserve\1""")
+TAG_NAME_RE = re.compile(r"<(/?)([^\s/>]+)")
+BOX_SIDES = ('top', 'right', 'bottom', 'left')
+
+# Offuscamento dei font (IDPF e Adobe): algoritmi in encryption.xml e byte offuscati
+ENCRYPTION_NAME = 'META-INF/encryption.xml'
+IDPF_OBFUSCATION = 'http://www.idpf.org/2008/embedding'
+ADOBE_OBFUSCATION = 'http://ns.adobe.com/pdf/enc#RC'
+OBFUSCATED_BYTES = {IDPF_OBFUSCATION: 1040, ADOBE_OBFUSCATION: 1024}
+ENCRYPTED_DATA_RE = re.compile(r"<(?:\w+:)?EncryptedData\b.*?</(?:\w+:)?EncryptedData\s*>", re.S)
+ALGORITHM_RE = re.compile(r"""\bAlgorithm\s*=\s*(["'])(.*?)\1""", re.S)
+CIPHER_URI_RE = re.compile(r"""<(?:\w+:)?CipherReference\b[^>]*\bURI\s*=\s*(["'])(.*?)\1""", re.S)
+
+# Pacchetto OPF: percorso in container.xml e identificatori nei metadati
+ROOTFILE_RE = re.compile(r"""<(?:\w+:)?rootfile\b[^>]*?\bfull-path\s*=\s*(["'])(.*?)\1""", re.I | re.S)
+PACKAGE_VERSION_RE = re.compile(r"""<(?:\w+:)?package\b[^>]*?\bversion\s*=\s*(["'])\s*(\d+)""", re.I | re.S)
+UNIQUE_IDENTIFIER_RE = re.compile(r"""<(?:\w+:)?package\b[^>]*?\bunique-identifier\s*=\s*(["'])(.*?)\1""", re.I | re.S)
+IDENTIFIER_RE = re.compile(r"<dc:identifier\b([^>]*)>(.*?)</dc:identifier\s*>", re.I | re.S)
+ID_RE = re.compile(r"""\bid\s*=\s*(["'])(.*?)\1""", re.I)
+
+# Grafo dei riferimenti per individuare le risorse che nessuno usa: tipi di membri
+# che possono essere rimossi, elementi e attributi dell'OPF che rimandano al manifest
+PRUNE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.svg', '.css', '.js',
+                    '.mp3', '.m4a', '.ogg', '.opus', '.mp4', '.m4v', '.webm') + FONT_EXTENSIONS
+MANIFEST_ELEMENT_RE = re.compile(r"\s*<(?:opf:)?item\b[^>]*?(?:/>|>\s*</(?:opf:)?item\s*>)", re.I | re.S)
+MANIFEST_BLOCK_RE = re.compile(r"<(?:opf:)?manifest\b.*?</(?:opf:)?manifest\s*>", re.I | re.S)
+ITEMREF_RE = re.compile(r"<(?:opf:)?(?:itemref|spine)\b[^>]*>", re.I | re.S)
+ID_REFERENCE_RE = re.compile(
+    r"""\b(?:idref|toc|page-map|fallback|fallback-style|media-overlay)\s*=\s*(["'])(.*?)\1""", re.I)
+PROPERTIES_RE = re.compile(r"""\bproperties\s*=\s*(["'])(.*?)\1""", re.I)
+COVER_META_RE = re.compile(r"""<(?:opf:)?meta\b[^>]*\bname\s*=\s*["']cover["'][^>]*>""", re.I | re.S)
+CONTENT_RE = re.compile(r"""\bcontent\s*=\s*(["'])(.*?)\1""", re.I)
+REFINES_RE = re.compile(r"""\brefines\s*=\s*(["'])#(.*?)\1""", re.I)
+SRCSET_RE = re.compile(r"""\bsrcset\s*=\s*(["'])(.*?)\1""", re.I | re.S)
+
+# Membro mimetype dell'OCF: primo nell'archivio, non compresso e con questo contenuto
+MIMETYPE_NAME = 'mimetype'
+EPUB_MIMETYPE = b'application/epub+zip'
+CONTAINER_NAME = 'META-INF/container.xml'
+
+# Data assegnata a tutti i membri, così gli stessi input producono archivi identici
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# Compressione dei membri dell'archivio: backend deflate disponibili, livello predefinito
+# (quello di zipfile), livello massimo di ISA-L e iterazioni di zopfli
+ZIP_BACKENDS = ('zlib', 'zlib-ng', 'isal', 'zopfli')
+DEFAULT_ZIP_LEVEL = 6
+ISAL_MAX_LEVEL = 3
+ZOPFLI_ITERATIONS = 15
+
+# Membri già compressi dal proprio formato (immagini, font WOFF, audio e video), salvati
+# senza deflate; per gli altri membri grandi, PNG compresi, si prova prima un campione, e
+# il deflate viene usato solo se riduce il campione almeno della frazione indicata
+STORED_EXTENSIONS = ('.jpg', '.jpeg', '.gif', '.webp', '.avif', '.woff', '.woff2',
+                     '.mp3', '.m4a', '.ogg', '.opus', '.mp4', '.m4v', '.webm', '.zip')
+DEFLATE_SAMPLE_SIZE = 64 * 1024
+DEFLATE_MIN_GAIN = 0.02
+
+# Costanti del formato ZIP usate per la copia dei membri senza ricompressione
+LOCAL_HEADER_SIZE = 30
+DATA_DESCRIPTOR_FLAG = 0x08
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Versione del formato della cache: va incrementata quando cambia il modo di comprimere
+CACHE_VERSION = 5
+# Libri compressi tra una pulizia della cache e la successiva: la pulizia scorre
+# tutta la directory, quindi avviene nel processo principale e non dopo ogni libro
+CACHE_EVICT_INTERVAL = 500
+
+# Limiti della ricerca della qualità JPEG per dimensione obiettivo
+JPEG_MIN_QUALITY = 10
+JPEG_MAX_TRIALS = 7
+
+# Tabella di quantizzazione della luminanza dello standard JPEG (Annex K), a cui
+# libjpeg applica il fattore di scala della qualità
+STD_LUMINANCE_QUANT_TABLE = (
+    16, 11, 10, 16, 24, 40, 51, 61,
+    12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56,
+    14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77,
+    24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101,
+    72, 92, 95, 98, 112, 100, 103, 99,
+)
+
+# Parametri del confronto percettivo: lato massimo della luminanza ridotta e finestra SSIM
+SSIM_SIZE = 512
+SSIM_BLOCK = 8
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+# Stima del picco di memoria della decodifica rispetto al solo raster (copie per
+# conversioni, ridimensionamento e codifica)
+DECODE_MEMORY_FACTOR = 3
+
+# Immagini in attesa nel pool per ogni processo: abbastanza da non lasciarli inattivi,
+# poche perché i dati letti dall'archivio non si accumulino nel processo principale
+IMAGE_QUEUE_PER_WORKER = 2
+
+# Dimensioni di palette provate per i PNG, corrispondenti alle profondità 1/2/4/8 bit e intermedie
+PALETTE_SIZES = (2, 4, 8, 16, 32, 64, 128, 256)
+
+# Analisi dei colori dei PNG: pixel campionati per la stima e margine, in bit,
+# aggiunto all'entropia dell'istogramma per scegliere la dimensione della palette
+COLOR_SAMPLE_SIZE = 256 * 1024
+ENTROPY_MARGIN_BITS = 1
+
+# Classificazione foto/grafica su una miniatura: lato della miniatura, soglia del
+# gradiente per i pixel piatti e per i bordi netti, soglie delle caratteristiche
+CLASSIFY_SIZE = 256
+FLAT_GRADIENT = 2
+EDGE_GRADIENT = 32
+PHOTO_MIN_COLOR_RATIO = 0.1
+PHOTO_MIN_ENTROPY = 5.0
+PHOTO_MAX_FLAT_RATIO = 0.5
+PHOTO_MAX_EDGE_SHARPNESS = 0.6
+
+# Deduplicazione percettiva: lato della griglia del dHash (64 bit), distanza di Hamming
+# massima e differenza massima tra le proporzioni perché due immagini siano candidate,
+# SSIM media e SSIM del blocco peggiore perché siano considerate la stessa immagine
+DHASH_SIZE = 8
+DEDUP_MAX_DISTANCE = 2
+DEDUP_MAX_ASPECT_DIFF = 0.01
+DEDUP_MIN_SSIM = 0.98
+DEDUP_MIN_BLOCK_SSIM = 0.5
+
+# Formati moderni disponibili per la conversione e sforzo dell'encoder WebP (0-6)
+MODERN_FORMATS = ('webp', 'avif')
+WEBP_METHOD = 4
+
+# Rimozione dei metadati: categorie conteggiate nel report e politiche per i profili ICC
+METADATA_CATEGORIES = ('exif', 'xmp', 'icc', 'text', 'comment', 'other')
+ICC_POLICIES = ('srgb', 'keep', 'strip')
+
+# Segmenti JPEG: marcatori e firme dei segmenti APPn con metadati
+JPEG_SOI = b'\xff\xd8'
+JPEG_SOS = 0xDA
+JPEG_COM = 0xFE
+JPEG_APP0 = 0xE0
+JPEG_APP15 = 0xEF
+JPEG_SIGNATURES = (
+    (0xE1, b'Exif\x00', 'exif'),
+    (0xE1, b'http://ns.adobe.com/', 'xmp'),
+    (0xE2, b'ICC_PROFILE\x00', 'icc'),
+    (0xED, b'Photoshop 3.0\x00', 'other'),
+)
+# Segmenti APPn necessari alla decodifica (JFIF e trasformazione colore Adobe)
+JPEG_KEEP_SEGMENTS = ((JPEG_APP0, b'JFIF\x00'), (JPEG_APP0, b'JFXX\x00'), (0xEE, b'Adobe'))
+
+# Tag EXIF Orientation e trasformazioni che portano i pixel nell'orientamento indicato
+EXIF_ORIENTATION = 0x0112
+ORIENTATION_TRANSPOSE = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+
+# Chunk PNG con metadati, ordinati per categoria
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_METADATA_CHUNKS = {
+    b'eXIf': 'exif',
+    b'iCCP': 'icc',
+    b'tEXt': 'text',
+    b'zTXt': 'text',
+    b'iTXt': 'text',
+    b'tIME': 'other',
+}
+PNG_XMP_KEYWORD = b'XML:com.adobe.xmp\x00'
+
+# Filtri disponibili per il ridimensionamento delle immagini
+RESAMPLE_FILTERS = {
+    'nearest': Image.NEAREST,
+    'bilinear': Image.BILINEAR,
+    'bicubic': Image.BICUBIC,
+    'lanczos': Image.LANCZOS,
+}
+
+def is_image(filename):
+    """
+    Indica se un membro dell'EPUB è un'immagine da ricomprimere.
+    """
+    return filename.lower().endswith(IMAGE_EXTENSIONS)
+
+def fit_size(width, height, max_width=None, max_height=None, max_pixels=None):
+    """
+    Calcola le dimensioni che rispettano i limiti indicati mantenendo le proporzioni.
+    Le immagini già entro i limiti non vengono mai ingrandite.
+    """
+    scale = 1.0
+    if max_width:
+        scale = min(scale, max_width / width)
+    if max_height:
+        scale = min(scale, max_height / height)
+    if max_pixels:
+        scale = min(scale, (max_pixels / (width * height)) ** 0.5)
+    if scale >= 1.0:
+        return width, height
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+def reduce_on_decode(img, size):
+    """
+    Prepara un'immagine non ancora caricata a essere decodificata a scala ridotta,
+    senza allocare il raster a piena risoluzione: per i JPEG usa draft(), che
+    sfrutta la riduzione DCT di libjpeg. Le dimensioni decodificate restano almeno
+    pari a size.
+    """
+    if size == img.size:
+        return
+    if img.format == "JPEG":
+        img.draft(img.mode, size)
+
+def decoded_size(img):
+    """
+    Stima i byte del raster che verrà allocato decodificando l'immagine.
+    """
+    width, height = img.size
+    return width * height * len(img.getbands())
+
+def downscale_image(img, size, resample='lanczos'):
+    """
+    Riduce l'immagine alle dimensioni indicate.
+    """
+    if size == img.size:
+        return img
+    if img.mode in ('1', 'P'):
+        # Con palette Pillow userebbe sempre il filtro nearest
+        img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+    return img.resize(size, RESAMPLE_FILTERS[resample])
+
+def encode_jpeg(img, quality):
+    """
+    Codifica un'immagine come JPEG in memoria e restituisce i byte.
+    """
+    output = io.BytesIO()
+    img.save(output, "JPEG", quality=quality, optimize=True, icc_profile=img.info.get('icc_profile'))
+    return output.getvalue()
+
+def search_jpeg_quality(img, budget, max_quality):
+    """
+    Cerca con una ricerca binaria la qualità JPEG più alta, non oltre max_quality,
+    il cui risultato sta entro budget byte. Le codifiche avvengono in memoria e sono
+    al massimo JPEG_MAX_TRIALS; se nessuna qualità rientra nel budget restituisce
+    la codifica alla qualità minima provata.
+    """
+    low, high = min(JPEG_MIN_QUALITY, max_quality), max_quality
+    best = None
+    smallest = None
+    for _ in range(JPEG_MAX_TRIALS):
+        if low > high:
+            break
+        quality = (low + high) // 2
+        encoded = encode_jpeg(img, quality)
+        if len(encoded) <= budget:
+            best = encoded
+            low = quality + 1
+        else:
+            high = quality - 1
+        if smallest is None or len(encoded) < len(smallest):
+            smallest = encoded
+    return best if best is not None else smallest
+
+def ssim_luma(img):
+    """
+    Restituisce la luminanza dell'immagine ridotta a SSIM_SIZE pixel di lato,
+    come array float64 con dimensioni multiple di SSIM_BLOCK.
+    """
+    luma = img.convert('L')
+    luma.thumbnail((SSIM_SIZE, SSIM_SIZE), Image.BILINEAR)
+    pixels = np.asarray(luma, dtype=np.float64)
+    height = pixels.shape[0] - pixels.shape[0] % SSIM_BLOCK
+    width = pixels.shape[1] - pixels.shape[1] % SSIM_BLOCK
+    return pixels[:height, :width]
+
+def ssim(reference, candidate):
+    """
+    Calcola la SSIM media tra due luminanze della stessa dimensione, su blocchi
+    SSIM_BLOCK x SSIM_BLOCK non sovrapposti, interamente con operazioni vettoriali.
+    """
+    if reference.size == 0:
+        return 1.0
+    return float(ssim_blocks(reference, candidate).mean())
+
+def ssim_blocks(reference, candidate):
+    """
+    Restituisce la mappa della SSIM di ogni blocco SSIM_BLOCK x SSIM_BLOCK tra due
+    luminanze della stessa dimensione.
+    """
+    height, width = reference.shape
+    shape = (height // SSIM_BLOCK, SSIM_BLOCK, width // SSIM_BLOCK, SSIM_BLOCK)
+    x = reference.reshape(shape)
+    y = candidate.reshape(shape)
+    mean_x = x.mean(axis=(1, 3))
+    mean_y = y.mean(axis=(1, 3))
+    var_x = (x * x).mean(axis=(1, 3)) - mean_x ** 2
+    var_y = (y * y).mean(axis=(1, 3)) - mean_y ** 2
+    cov_xy = (x * y).mean(axis=(1, 3)) - mean_x * mean_y
+    return ((2 * mean_x * mean_y + SSIM_C1) * (2 * cov_xy + SSIM_C2)) / \
+           ((mean_x ** 2 + mean_y ** 2 + SSIM_C1) * (var_x + var_y + SSIM_C2))
+
+def search_ssim_quality(img, min_ssim, max_quality):
+    """
+    Cerca con una ricerca binaria la qualità JPEG più bassa, non oltre max_quality,
+    la cui somiglianza percettiva (SSIM sulla luminanza) con l'originale resta almeno
+    min_ssim. Restituisce la qualità scelta e la relativa codifica.
+    """
+    reference = ssim_luma(img)
+    low, high = min(JPEG_MIN_QUALITY, max_quality), max_quality
+    best_quality, best = max_quality, None
+    for _ in range(JPEG_MAX_TRIALS):
+        if low > high:
+            break
+        quality = (low + high) // 2
+        encoded = encode_jpeg(img, quality)
+        with Image.open(io.BytesIO(encoded)) as decoded:
+            score = ssim(reference, ssim_luma(decoded))
+        if score >= min_ssim:
+            best_quality, best = quality, encoded
+            high = quality - 1
+        else:
+            low = quality + 1
+    if best is None:
+        best = encode_jpeg(img, max_quality)
+    return best_quality, best
+
+def has_alpha(img):
+    """
+    Indica se l'immagine ha un canale alpha o un colore trasparente.
+    """
+    return img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+
+def quantize_error(reference, quantized):
+    """
+    Calcola l'errore medio assoluto per canale (0-255) tra l'originale RGBA e la
+    versione con palette. I colori sono pesati per l'alpha, così le differenze nei
+    pixel trasparenti, invisibili, non contano.
+    """
+    original = np.asarray(reference, dtype=np.float32)
+    candidate = np.asarray(quantized.convert('RGBA'), dtype=np.float32)
+    original[..., :3] *= original[..., 3:] / 255
+    candidate[..., :3] *= candidate[..., 3:] / 255
+    return float(np.abs(original - candidate).mean())
+
+def quantize_png(img, max_error=None, colors=256):
+    """
+    Riduce un'immagine a palette mantenendo l'eventuale trasparenza.
+    Le immagini con alpha vengono quantizzate in RGBA con libimagequant, se Pillow
+    lo supporta, altrimenti con l'octree veloce; le altre con il median cut.
+    Con max_error viene scelta, con una ricerca binaria su PALETTE_SIZES, la palette
+    più piccola il cui errore medio resta entro la soglia; altrimenti colors colori.
+    """
+    if has_alpha(img):
+        source = img.convert('RGBA')
+        method = Image.LIBIMAGEQUANT if features.check_feature('libimagequant') else Image.FASTOCTREE
+    else:
+        source = img.convert('RGB')
+        method = Image.MEDIANCUT
+
+    if max_error is None:
+        return source.quantize(colors=colors, method=method, dither=Image.NONE)
+
+    reference = source.convert('RGBA')
+    low, high = 0, len(PALETTE_SIZES) - 1
+    best = None
+    while low <= high:
+        middle = (low + high) // 2
+        quantized = source.quantize(colors=PALETTE_SIZES[middle], method=method, dither=Image.NONE)
+        if quantize_error(reference, quantized) <= max_error:
+            best = quantized
+            high = middle - 1
+        else:
+            low = middle + 1
+    if best is None:
+        best = source.quantize(colors=PALETTE_SIZES[-1], method=method, dither=Image.NONE)
+    return best
+
+def pack_colors(pixels):
+    """
+    Rappresenta ogni pixel RGB o RGBA come un unico intero a 32 bit.
+    """
+    channels = pixels.reshape(-1, pixels.shape[2]).astype(np.uint32)
+    packed = (channels[:, 0] << 24) | (channels[:, 1] << 16) | (channels[:, 2] << 8)
+    if pixels.shape[2] == 4:
+        packed |= channels[:, 3]
+    return packed
+
+def entropy_colors(packed):
+    """
+    Stima la dimensione della palette dall'entropia dell'istogramma dei colori,
+    ridotti a 5 bit per canale: un'entropia di H bit corrisponde a circa 2^H colori
+    effettivamente usati.
+    """
+    _, counts = np.unique(packed & 0xF8F8F8F8, return_counts=True)
+    probabilities = counts / counts.sum()
+    entropy = float(-(probabilities * np.log2(probabilities)).sum())
+    bits = int(np.ceil(entropy)) + ENTROPY_MARGIN_BITS
+    return min(max(2 ** bits, PALETTE_SIZES[0]), PALETTE_SIZES[-1])
+
+def palette_bits(colors):
+    """
+    Restituisce la profondità PNG minima (1, 2, 4 o 8 bit) per il numero di colori.
+    """
+    for bits in (1, 2, 4):
+        if colors <= 2 ** bits:
+            return bits
+    return 8
+
+def palettize_png(img, max_error=None):
+    """
+    Sceglie la rappresentazione più compatta per un PNG analizzandone i colori:
+    - scala di grigi senza trasparenza con più di 16 livelli: modo L, senza perdita;
+    - al massimo 256 colori: palette esatta, senza perdita;
+    - altrimenti quantizzazione, con la palette più piccola entro max_error se
+      indicato, o con una dimensione stimata dall'entropia dei colori.
+    """
+    source = img.convert('RGBA' if has_alpha(img) else 'RGB')
+    pixels = np.asarray(source)
+    packed = pack_colors(pixels)
+    sample = packed[::max(1, packed.size // COLOR_SAMPLE_SIZE)]
+    grayscale = source.mode == 'RGB' and \
+        np.array_equal(pixels[..., 0], pixels[..., 1]) and np.array_equal(pixels[..., 1], pixels[..., 2])
+
+    # Il campione basta a escludere le immagini con troppi colori senza contarli tutti
+    if np.unique(sample).size <= 256:
+        palette, indices = np.unique(packed, return_inverse=True)
+        if palette.size <= 256 and not (grayscale and palette.size > 16):
+            result = Image.frombytes('P', source.size, indices.astype(np.uint8).tobytes())
+            channels = [(palette >> shift) & 0xFF for shift in (24, 16, 8)]
+            if source.mode == 'RGBA':
+                channels.append(palette & 0xFF)
+            result.putpalette(np.stack(channels, axis=1).astype(np.uint8).tobytes(), source.mode)
+            return result
+
+    if grayscale:
+        return source.convert('L')
+
+    colors = PALETTE_SIZES[-1] if max_error is not None else entropy_colors(sample)
+    return quantize_png(source, max_error, colors)
+
+def encode_png(img):
+    """
+    Codifica un'immagine come PNG in memoria, usando per le immagini con palette
+    la profondità minima (1, 2, 4 o 8 bit) sufficiente per i colori usati.
+    """
+    output = io.BytesIO()
+    options = {}
+    if img.mode == 'P':
+        options['bits'] = palette_bits(img.getextrema()[1] + 1)
+    img.save(output, "PNG", optimize=True, **options)
+    return output.getvalue()
+
+def encode_modern(img, target_format, quality, lossless=False):
+    """
+    Codifica un'immagine come WebP o AVIF in memoria e restituisce i byte.
+    """
+    output = io.BytesIO()
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if has_alpha(img) else 'RGB')
+    if target_format == 'webp':
+        img.save(output, "WEBP", quality=quality, lossless=lossless, method=WEBP_METHOD,
+                 icc_profile=img.info.get('icc_profile'))
+    else:
+        img.save(output, "AVIF", quality=quality)
+    return output.getvalue()
+
+def estimate_jpeg_quality(img):
+    """
+    Stima la qualità (1-100) con cui è stato salvato un JPEG confrontando la sua
+    tabella di quantizzazione della luminanza con quella standard, invertendo la
+    scala usata da libjpeg. Legge solo l'header: i pixel non vengono decodificati.
+    Restituisce None se le tabelle non sono disponibili.
+    """
+    tables = getattr(img, 'quantization', None)
+    if not tables or 0 not in tables:
+        return None
+    scale = sum(tables[0]) * 100 / sum(STD_LUMINANCE_QUANT_TABLE)
+    quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+    return int(min(max(round(quality), 1), 100))
+
+def add_saving(savings, category, size):
+    """
+    Somma size byte alla categoria di metadati indicata.
+    """
+    savings[category] = savings.get(category, 0) + size
+
+def jpeg_segment_category(marker, payload):
+    """
+    Restituisce la categoria di metadati di un segmento JPEG, oppure None se il
+    segmento serve alla decodifica e va mantenuto.
+    """
+    if marker == JPEG_COM:
+        return 'comment'
+    if not JPEG_APP0 <= marker <= JPEG_APP15:
+        return None
+    for signature_marker, signature, category in JPEG_SIGNATURES:
+        if marker == signature_marker and payload.startswith(signature):
+            return category
+    for keep_marker, signature in JPEG_KEEP_SEGMENTS:
+        if marker == keep_marker and payload.startswith(signature):
+            return None
+    return 'other'
+
+def exif_orientation(payload):
+    """
+    Restituisce il valore del tag Orientation di un segmento EXIF, 1 se manca o
+    non è valido.
+    """
+    try:
+        exif = Image.Exif()
+        exif.load(payload)
+        orientation = exif.get(EXIF_ORIENTATION, 1)
+    except Exception:
+        return 1
+    return orientation if orientation in ORIENTATION_TRANSPOSE else 1
+
+def orientation_segment(orientation):
+    """
+    Costruisce un segmento APP1 EXIF minimo che contiene solo il tag Orientation.
+    """
+    tiff = b'MM\x00\x2a' + struct.pack('>IHHHIHHI', 8, 1, EXIF_ORIENTATION, 3, 1, orientation, 0, 0)
+    payload = b'Exif\x00\x00' + tiff
+    return b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+
+def insert_orientation(data, orientation):
+    """
+    Inserisce in un JPEG senza EXIF un segmento EXIF minimo con l'orientamento
+    indicato, dopo l'eventuale segmento JFIF.
+    """
+    pos = len(JPEG_SOI)
+    if data[pos] == 0xFF and data[pos + 1] == JPEG_APP0:
+        pos += 2 + struct.unpack('>H', data[pos + 2:pos + 4])[0]
+    return data[:pos] + orientation_segment(orientation) + data[pos:]
+
+def strip_jpeg_metadata(data, drop_icc=False):
+    """
+    Rimuove da un JPEG, senza decodificarlo, i segmenti di metadati che precedono la
+    scansione: EXIF (con la miniatura), XMP, Photoshop/IPTC, commenti e gli altri
+    APPn non necessari alla decodifica; il profilo ICC solo con drop_icc.
+    Se l'EXIF indica un orientamento, al suo posto resta un EXIF minimo con il
+    solo tag Orientation, perché i pixel sono salvati ruotati.
+    Restituisce i nuovi byte e i byte rimossi per categoria.
+    """
+    savings = {}
+    output = [JPEG_SOI]
+    pos = len(JPEG_SOI)
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Byte di riempimento tra i segmenti
+            pos += 1
+            continue
+        if marker == JPEG_SOS:
+            break
+        end = pos + 2 + struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        category = jpeg_segment_category(marker, data[pos + 4:end])
+        orientation = exif_orientation(data[pos + 4:end]) if category == 'exif' else 1
+        if orientation != 1:
+            segment = orientation_segment(orientation)
+            add_saving(savings, category, end - pos - len(segment))
+            output.append(segment)
+        elif category and (category != 'icc' or drop_icc):
+            add_saving(savings, category, end - pos)
+        else:
+            output.append(data[pos:end])
+        pos = end
+    # La scansione e tutto ciò che segue restano invariati
+    output.append(data[pos:])
+    return b''.join(output), savings
+
+def strip_png_metadata(data, drop_icc=False):
+    """
+    Rimuove da un PNG, senza decodificarlo, i chunk di metadati: EXIF, testo (tra
+    cui l'XMP), data di modifica ed eventuali dati dopo la fine dell'immagine; il
+    profilo ICC solo con drop_icc.
+    Restituisce i nuovi byte e i byte rimossi per categoria.
+    """
+    savings = {}
+    output = [PNG_SIGNATURE]
+    pos = len(PNG_SIGNATURE)
+    while pos + 12 <= len(data):
+        length = struct.unpack('>I', data[pos:pos + 4])[0]
+        chunk_type = data[pos + 4:pos + 8]
+        end = pos + 12 + length
+        category = PNG_METADATA_CHUNKS.get(chunk_type)
+        if chunk_type == b'iTXt' and data[pos + 8:end].startswith(PNG_XMP_KEYWORD):
+            category = 'xmp'
+        if category and (category != 'icc' or drop_icc):
+            add_saving(savings, category, end - pos)
+        else:
+            output.append(data[pos:end])
+        pos = end
+        if chunk_type == b'IEND':
+            break
+    if pos < len(data):
+        add_saving(savings, 'other', len(data) - pos)
+    return b''.join(output), savings
+
+def strip_image_metadata(data, drop_icc=False):
     """
-    Comprime un'immagine:
-    - Se è un JPEG, applica la compressione lossless con la qualità specificata.
-    - Se è un PNG, riduce i colori a 256 (8-bit).
+    Rimuove i metadati da un JPEG o da un PNG riconosciuto dalla firma, qualunque
+    sia l'estensione. Restituisce i nuovi byte e i byte rimossi per categoria;
+    gli altri formati restano invariati.
+    """
+    if data.startswith(JPEG_SOI):
+        return strip_jpeg_metadata(data, drop_icc)
+    if data.startswith(PNG_SIGNATURE):
+        return strip_png_metadata(data, drop_icc)
+    return data, {}
+
+def is_srgb_profile(profile):
+    """
+    Indica se un profilo ICC descrive lo spazio colore sRGB.
     """
     try:
-        img = Image.open(image_path)
-        if image_path.lower().endswith('.jpg') or image_path.lower().endswith('.jpeg'):
-            # Compressione lossless per JPEG
-            img.save(image_path, "JPEG", quality=quality, optimize=True)
-        elif image_path.lower().endswith('.png'):
-            # Riduzione a 256 colori per PNG
-            img = img.convert('P', palette=Image.ADAPTIVE, colors=256)
-            img.save(image_path, "PNG", optimize=True)
+        description = ImageCms.getProfileDescription(ImageCms.ImageCmsProfile(io.BytesIO(profile)))
+    except Exception:
+        return False
+    return 'srgb' in description.lower()
+
+def apply_icc_policy(img, icc_policy):
+    """
+    Applica la politica sui profili ICC a un'immagine decodificata:
+    - 'keep' mantiene il profilo originale;
+    - 'srgb' mantiene i profili sRGB e converte in sRGB le immagini RGB e CMYK con
+      altri profili, che poi non ne hanno più bisogno;
+    - 'strip' elimina il profilo senza convertire i colori.
+    Il profilo rimasto in img.info viene incorporato dagli encoder.
+    """
+    profile = img.info.get('icc_profile')
+    if not profile or icc_policy == 'keep':
+        return img
+    if icc_policy == 'srgb':
+        if is_srgb_profile(profile) or img.mode not in ('RGB', 'RGBA', 'CMYK'):
+            return img
+        output_mode = 'RGBA' if img.mode == 'RGBA' else 'RGB'
+        img = ImageCms.profileToProfile(img, ImageCms.ImageCmsProfile(io.BytesIO(profile)),
+                                        ImageCms.createProfile('sRGB'), outputMode=output_mode)
+    img.info.pop('icc_profile', None)
+    return img
+
+def optimize_jpeg_lossless(data, progressive=False, keep_icc=True, orientation=1):
+    """
+    Ottimizza un JPEG senza perdita: tabelle di Huffman ottimizzate, eventuale
+    codifica progressiva e rimozione di EXIF e XMP, tranne l'orientamento; il
+    profilo ICC viene mantenuto solo con keep_icc, perché senza ricodifica non è
+    possibile convertirlo in sRGB.
+    Con jpegtran lavora direttamente sui coefficienti DCT. Senza jpegtran la
+    scansione resta intatta e vengono solo rimossi i metadati con
+    strip_jpeg_metadata: decodificare e ricodificare, anche con le tabelle di
+    quantizzazione originali, perderebbe qualità a ogni passaggio.
+    """
+    jpegtran = shutil.which("jpegtran")
+    if not jpegtran:
+        return strip_jpeg_metadata(data, drop_icc=not keep_icc)[0]
+    command = [jpegtran, "-copy", "icc" if keep_icc else "none", "-optimize"]
+    if progressive:
+        command.append("-progressive")
+    compressed = subprocess.run(command, input=data, capture_output=True, check=True).stdout
+    # jpegtran scarta l'EXIF, compreso l'orientamento, che va rimesso
+    return insert_orientation(compressed, orientation) if orientation != 1 else compressed
+
+def compress_jpeg(img, original_size, quality, target_kb=None, target_ratio=None, min_ssim=None):
+    """
+    Codifica un'immagine come JPEG con la qualità indicata, oppure con quella scelta
+    dalla soglia percettiva e/o dalla dimensione obiettivo, e restituisce i byte.
+    """
+    if img.mode not in ('RGB', 'L', 'CMYK'):
+        img = img.convert('RGB')
+
+    # Dimensione obiettivo: la più restrittiva tra quelle richieste
+    budgets = []
+    if target_kb:
+        budgets.append(target_kb * 1024)
+    if target_ratio:
+        budgets.append(original_size * target_ratio)
+    if min_ssim:
+        # La qualità percettiva diventa il massimo per l'eventuale dimensione obiettivo
+        quality, compressed = search_ssim_quality(img, min_ssim, quality)
+        if budgets and len(compressed) > min(budgets):
+            compressed = search_jpeg_quality(img, min(budgets), quality)
+        return compressed
+    if budgets:
+        return search_jpeg_quality(img, min(budgets), quality)
+    # Ricodifica con perdita alla qualità indicata
+    return encode_jpeg(img, quality)
+
+def image_features(img):
+    """
+    Calcola con NumPy, su una miniatura, le caratteristiche usate per distinguere
+    le fotografie dalla grafica:
+    - color_ratio: colori distinti rispetto ai pixel (alto nelle foto);
+    - entropy: entropia in bit dell'istogramma della luminanza (alta nelle foto);
+    - flat_ratio: frazione di pixel con gradiente quasi nullo (alta nella grafica);
+    - edge_sharpness: frazione di bordi netti tra i pixel non piatti (alta nel testo
+      e nei disegni al tratto, bassa nelle sfumature delle foto).
+    """
+    thumbnail = img.convert('RGB')
+    # Il filtro nearest non introduce colori intermedi che falserebbero il conteggio
+    thumbnail.thumbnail((CLASSIFY_SIZE, CLASSIFY_SIZE), Image.NEAREST)
+    pixels = np.asarray(thumbnail)
+    packed = pack_colors(pixels)
+    luma = np.asarray(thumbnail.convert('L'), dtype=np.int16)
+
+    histogram = np.bincount(luma.ravel(), minlength=256) / luma.size
+    histogram = histogram[histogram > 0]
+    gradient = np.maximum(np.abs(np.diff(luma, axis=1))[:-1, :], np.abs(np.diff(luma, axis=0))[:, :-1])
+    flat_ratio = float((gradient <= FLAT_GRADIENT).mean()) if gradient.size else 1.0
+    edge_ratio = float((gradient > EDGE_GRADIENT).mean()) if gradient.size else 0.0
+
+    return {
+        'color_ratio': np.unique(packed).size / packed.size,
+        'entropy': float(-(histogram * np.log2(histogram)).sum()),
+        'flat_ratio': flat_ratio,
+        'edge_sharpness': edge_ratio / (1 - flat_ratio) if flat_ratio < 1 else 1.0,
+    }
+
+def is_photographic(img):
+    """
+    Indica se un'immagine opaca è una fotografia, adatta a una codifica con perdita,
+    oppure grafica piatta o testo, adatta a una palette.
+    """
+    if has_alpha(img):
+        return False
+    values = image_features(img)
+    return (values['color_ratio'] > PHOTO_MIN_COLOR_RATIO
+            and values['entropy'] > PHOTO_MIN_ENTROPY
+            and values['flat_ratio'] < PHOTO_MAX_FLAT_RATIO
+            and values['edge_sharpness'] < PHOTO_MAX_EDGE_SHARPNESS)
+
+def reencode_image(data, filename, quality=70, target_kb=None, target_ratio=None, min_ssim=None,
+                   max_width=None, max_height=None, max_pixels=None, resample='lanczos',
+                   max_memory_mb=None, png_max_error=None, convert_to=None, png_to_jpeg=False,
+                   classify=False, jpeg_lossless=False, jpeg_progressive=False, force_reencode=False,
+                   icc_policy='srgb'):
+    """
+    Ricodifica un'immagine in memoria.
+    Se sono indicate dimensioni massime l'immagine viene decodificata direttamente a
+    scala ridotta, quando il formato lo consente, e poi ridimensionata.
+    Con classify il trattamento non dipende dall'estensione: le fotografie vengono
+    codificate come JPEG, la grafica e il testo come PNG con palette. Altrimenti:
+    - Con convert_to ('webp' o 'avif') viene convertita nel nuovo formato: le foto con
+      la qualità specificata, la grafica PNG in WebP lossless.
+    - Se è un JPEG, lo ricodifica con perdita alla qualità specificata, mai superiore
+      a quella stimata dell'originale; i JPEG già salvati a una qualità non superiore
+      e da non ridimensionare vengono lasciati invariati senza decodificarli, a meno
+      di force_reencode.
+      Con jpeg_lossless, se non va ridimensionato, viene invece ottimizzato senza
+      perdita (vedi optimize_jpeg_lossless): la scansione non viene mai ricodificata.
+      Con min_ssim viene scelta la qualità più bassa che mantiene la somiglianza
+      percettiva richiesta; con target_kb e/o target_ratio la qualità viene cercata
+      per ogni immagine, fino al massimo indicato, in modo da non superare la
+      dimensione obiettivo.
+    - Se è un PNG, sceglie in base ai colori usati tra scala di grigi, palette esatta
+      a 1/2/4/8 bit e quantizzazione con trasparenza; con png_max_error la palette
+      quantizzata è la più piccola che resta entro l'errore indicato.
+      Con png_to_jpeg i PNG fotografici opachi, e quelli che contengono in realtà
+      dati JPEG, diventano JPEG con estensione .jpg.
+    Il profilo ICC viene trattato secondo icc_policy (vedi apply_icc_policy).
+    L'orientamento EXIF viene applicato ai pixel, perché la nuova codifica non
+    conserva l'EXIF; l'ottimizzazione senza perdita mantiene invece il solo tag.
+    Restituisce i nuovi byte e l'estensione del formato prodotto, anche se più grandi
+    dell'originale, oppure None se l'immagine non va ricodificata: quando la
+    decodifica richiederebbe più di max_memory_mb e in caso di errore.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            orientation = source.getexif().get(EXIF_ORIENTATION, 1)
+            if orientation not in ORIENTATION_TRANSPOSE:
+                orientation = 1
+            if orientation >= 5:
+                # Immagine ruotata di 90 gradi: i limiti valgono per come viene mostrata
+                size = fit_size(source.width, source.height, max_height, max_width, max_pixels)
+            else:
+                size = fit_size(source.width, source.height, max_width, max_height, max_pixels)
+            if (jpeg_lossless and source.format == "JPEG" and extension in ('.jpg', '.jpeg')
+                    and size == source.size and not (convert_to or classify)):
+                # Ottimizzazione senza perdita, senza decodificare né riquantizzare
+                compressed = optimize_jpeg_lossless(data, jpeg_progressive, icc_policy != 'strip', orientation)
+            else:
+                # Ricodificare sopra la qualità dell'originale produce solo file più grandi
+                source_quality = estimate_jpeg_quality(source) if source.format == "JPEG" else None
+                if source_quality is not None and not (convert_to or force_reencode):
+                    plain_reencode = (extension in ('.jpg', '.jpeg') and size == source.size
+                                      and not (classify or target_kb or target_ratio or min_ssim))
+                    if plain_reencode and source_quality <= quality:
+                        return None
+                    quality = min(quality, source_quality)
+
+                reduce_on_decode(source, size)
+
+                # Non decodificare immagini che supererebbero il limite di memoria del processo
+                if max_memory_mb and decoded_size(source) * DECODE_MEMORY_FACTOR > max_memory_mb * 1024 * 1024:
+                    print(f"{Fore.YELLOW}Immagine {filename} oltre il limite di memoria, lasciata invariata")
+                    return None
+
+                img = apply_icc_policy(downscale_image(source, size, resample), icc_policy)
+                if orientation != 1:
+                    img = img.transpose(ORIENTATION_TRANSPOSE[orientation])
+                try:
+                    # Scegli l'encoder: dal contenuto con classify, altrimenti dall'estensione
+                    if classify:
+                        target = 'jpeg' if is_photographic(img) else 'png'
+                    elif extension in ('.jpg', '.jpeg'):
+                        target = 'jpeg'
+                    elif extension == '.png' and png_to_jpeg and (source.format == "JPEG" or is_photographic(img)):
+                        # Foto salvata come PNG: diventa un vero JPEG, con il nome corretto
+                        target = 'jpeg'
+                    elif extension == '.png':
+                        target = 'png'
+                    else:
+                        return None
+
+                    if convert_to:
+                        # Conversione nel formato moderno, lossless per la grafica
+                        compressed = encode_modern(img, convert_to, quality, lossless=(target == 'png'))
+                        extension = '.' + convert_to
+                    elif target == 'jpeg':
+                        compressed = compress_jpeg(img, len(data), quality, target_kb, target_ratio, min_ssim)
+                        if extension not in ('.jpg', '.jpeg'):
+                            extension = '.jpg'
+                    else:
+                        # Riduzione dei colori per PNG, scelta in base all'analisi dei colori
+                        icc_profile = img.info.get('icc_profile')
+                        img = palettize_png(img, png_max_error)
+                        if icc_profile:
+                            img.info['icc_profile'] = icc_profile
+                        compressed = encode_png(img)
+                        extension = '.png'
+                finally:
+                    img.close()
+        return compressed, extension
     except Exception as e:
-        print(f"{Fore.RED}Errore durante la compressione di {image_path}: {e}")
+        print(f"{Fore.RED}Errore durante la compressione di {filename}: {e}")
+        return None
 
-def compress_epub(epub_file, quality, output_dir):
+def compress_image(data, filename, min_saving=0, strip_metadata=False, icc_policy='srgb', **options):
     """
-    Comprime un file EPUB, applicando la compressione alle immagini.
+    Comprime un'immagine in memoria.
+    Con strip_metadata vengono prima rimossi senza decodifica EXIF, XMP, testo,
+    commenti e miniature, e con icc_policy 'strip' anche il profilo ICC; poi
+    l'immagine viene ricodificata con reencode_image e le opzioni indicate.
+    Tra la versione ricodificata e quella solo ripulita viene tenuta la più piccola.
+    Restituisce i nuovi byte, l'estensione del formato prodotto e i byte di metadati
+    rimossi per categoria, oppure None se l'immagine deve restare invariata: quando
+    non viene ridotta di almeno min_saving per cento e in caso di errore.
     """
-    print(f"\n{Fore.YELLOW}Inizio compressione: {epub_file}")
+    extension = os.path.splitext(filename)[1].lower()
+    metadata_savings = {}
+    if strip_metadata:
+        try:
+            data_stripped, metadata_savings = strip_image_metadata(data, drop_icc=(icc_policy == 'strip'))
+        except Exception as e:
+            print(f"{Fore.RED}Errore durante la rimozione dei metadati di {filename}: {e}")
+            data_stripped = data
+    else:
+        data_stripped = data
 
-    initial_size = os.path.getsize(epub_file)
-    temp_compressed_file = os.path.splitext(epub_file)[0] + "_compressed.epub"
-    temp_dir = "temp_epub"
+    candidates = [(data_stripped, extension)] if len(data_stripped) < len(data) else []
+    reencoded = reencode_image(data_stripped, filename, icc_policy=icc_policy, **options)
+    if reencoded:
+        candidates.append(reencoded)
+    if not candidates:
+        return None
+    compressed, extension = min(candidates, key=lambda candidate: len(candidate[0]))
+
+    # Tieni l'originale se la ricompressione non fa risparmiare abbastanza
+    if len(compressed) >= len(data) * (1 - min_saving / 100):
+        return None
+    return compressed, extension, metadata_savings
+
+def dhash(img):
+    """
+    Calcola l'hash percettivo (dHash a 64 bit) di un'immagine: il segno del
+    gradiente orizzontale della luminanza su una miniatura 9x8.
+    """
+    reduce_on_decode(img, (DHASH_SIZE + 1, DHASH_SIZE))
+    thumbnail = img.convert('L').resize((DHASH_SIZE + 1, DHASH_SIZE), Image.BILINEAR)
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    return int.from_bytes(np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes(), 'big')
+
+def same_picture(luma, kept_luma):
+    """
+    Conferma che due immagini candidate alla deduplicazione siano la stessa
+    immagine: le luminanze vengono portate alla dimensione della più piccola e
+    devono avere una SSIM media di almeno DEDUP_MIN_SSIM e nessun blocco sotto
+    DEDUP_MIN_BLOCK_SSIM, così anche una differenza locale, come il numero di un
+    capitolo su una pagina altrimenti uguale, basta a tenerle distinte.
+    """
+    size = min(luma.size, kept_luma.size, key=lambda size: size[0] * size[1])
+    reference = ssim_luma(kept_luma.resize(size, Image.BILINEAR) if kept_luma.size != size else kept_luma)
+    candidate = ssim_luma(luma.resize(size, Image.BILINEAR) if luma.size != size else luma)
+    if reference.size == 0:
+        return True
+    blocks = ssim_blocks(reference, candidate)
+    return blocks.mean() >= DEDUP_MIN_SSIM and blocks.min() >= DEDUP_MIN_BLOCK_SSIM
+
+def find_duplicate_images(zip_in, image_infos, perceptual=False):
+    """
+    Individua le immagini duplicate dell'EPUB.
+    Le copie identiche vengono cercate confrontando prima CRC e dimensione
+    registrati nell'archivio e poi l'hash SHA-256 dei soli candidati; resta la
+    prima copia nell'ordine dell'archivio.
+    Con perceptual sono candidate anche le immagini con la stessa trasparenza,
+    le stesse proporzioni e un dHash che differisce al più di DEDUP_MAX_DISTANCE
+    bit, ad esempio la stessa illustrazione salvata con qualità o dimensioni
+    diverse; diventano duplicate solo se il confronto SSIM di same_picture lo
+    conferma, e resta quella con più pixel.
+    Restituisce un dizionario nome del duplicato -> nome della copia mantenuta.
+    """
+    duplicates = {}
+    groups = {}
+    for info in image_infos:
+        groups.setdefault((info.CRC, info.file_size), []).append(info)
+    for group in groups.values():
+        if len(group) < 2:
+            continue
+        kept = {}
+        for info in group:
+            digest = hashlib.sha256(zip_in.read(info)).digest()
+            if digest in kept:
+                duplicates[info.filename] = kept[digest]
+            else:
+                kept[digest] = info.filename
+    if not perceptual:
+        return duplicates
+
+    signatures = []
+    for info in image_infos:
+        if info.filename in duplicates:
+            continue
+        try:
+            with Image.open(io.BytesIO(zip_in.read(info))) as img:
+                pixels, aspect, alpha = img.width * img.height, img.width / img.height, has_alpha(img)
+                reduce_on_decode(img, (SSIM_SIZE, SSIM_SIZE))
+                luma = img.convert('L')
+            luma.thumbnail((SSIM_SIZE, SSIM_SIZE), Image.BILINEAR)
+            signature = (info.filename, pixels, info.file_size, aspect, alpha, dhash(luma), luma)
+        except Exception as e:
+            print(f"{Fore.YELLOW}Impossibile calcolare l'hash percettivo di {info.filename}: {e}")
+            continue
+        signatures.append(signature)
+
+    # Le immagini più grandi vengono considerate per prime e diventano le copie mantenute
+    signatures.sort(key=lambda signature: (-signature[1], -signature[2]))
+    kept = []
+    for name, _, _, aspect, alpha, image_hash, luma in signatures:
+        for kept_name, kept_aspect, kept_alpha, kept_hash, kept_luma in kept:
+            if (alpha == kept_alpha and abs(aspect - kept_aspect) <= DEDUP_MAX_ASPECT_DIFF * kept_aspect
+                    and bin(image_hash ^ kept_hash).count('1') <= DEDUP_MAX_DISTANCE
+                    and same_picture(luma, kept_luma)):
+                duplicates[name] = kept_name
+                break
+        else:
+            kept.append((name, aspect, alpha, image_hash, luma))
+    # Le copie identiche seguono la copia mantenuta dalla deduplicazione percettiva
+    return {name: duplicates.get(kept_name, kept_name) for name, kept_name in duplicates.items()}
+
+def rename_member(filename, extension, existing_names):
+    """
+    Restituisce il nuovo nome di un membro convertito in un altro formato, evitando
+    i nomi già presenti nell'archivio.
+    """
+    stem, old_extension = posixpath.splitext(filename)
+    new_name = stem + extension
+    if new_name in existing_names:
+        new_name = f"{stem}_{old_extension.lstrip('.').lower()}{extension}"
+    return new_name
+
+def resolve_reference(member_name, url):
+    """
+    Risolve un riferimento relativo trovato in un membro nel percorso del membro
+    a cui punta. Restituisce None per URL assoluti, frammenti interni e data URI.
+    """
+    path, _ = split_url(url)
+    if not path or path.startswith('/') or urllib.parse.urlsplit(path).scheme:
+        return None
+    base = posixpath.dirname(member_name)
+    return posixpath.normpath(posixpath.join(base, urllib.parse.unquote(path)))
+
+def split_url(url):
+    """
+    Separa il percorso di un URL dalla parte di query e frammento.
+    """
+    match = re.match(r'([^?#]*)(.*)', url, re.S)
+    return match.group(1), match.group(2)
+
+def rewrite_url(member_name, url, renames, escaped=False):
+    """
+    Restituisce l'URL aggiornato se punta a un membro rinominato, altrimenti None.
+    Con escaped l'URL viene da un documento XML: le entità vengono decodificate
+    prima di risolverlo e il nuovo URL viene restituito di nuovo con gli escape.
+    """
+    if escaped:
+        url = html.unescape(url)
+    target = resolve_reference(member_name, url.strip())
+    if target not in renames:
+        return None
+    base = posixpath.dirname(member_name) or '.'
+    new_path = urllib.parse.quote(posixpath.relpath(renames[target], base), safe=URL_SAFE_CHARS)
+    new_url = new_path + split_url(url.strip())[1]
+    return html.escape(new_url) if escaped else new_url
+
+def rewrite_references(text, member_name, renames):
+    """
+    Aggiorna in un documento XHTML, NCX, SVG o CSS tutti i riferimenti (src, href,
+    xlink:href, srcset e url() dei CSS) ai membri rinominati.
+    """
+    # Fuori dai CSS i riferimenti, anche quelli negli stili, sono in documenti XML
+    escaped = not member_name.lower().endswith('.css')
+
+    def replace_attribute(match):
+        new_url = rewrite_url(member_name, match.group(3), renames, escaped)
+        if new_url is None:
+            return match.group(0)
+        return match.group(1) + match.group(2) + new_url + match.group(2)
+
+    def replace_css_url(match):
+        new_url = rewrite_url(member_name, match.group(3), renames, escaped)
+        if new_url is None:
+            return match.group(0)
+        return match.group(1) + match.group(2) + new_url + match.group(2) + match.group(4)
 
+    def replace_srcset(match):
+        # Ogni candidato è un URL seguito da un eventuale descrittore (2x, 800w)
+        candidates = []
+        for candidate in match.group(2).split(','):
+            parts = re.match(r'(\s*)(\S*)(.*)', candidate, re.S)
+            new_url = rewrite_url(member_name, parts.group(2), renames, escaped) if parts.group(2) else None
+            candidates.append(candidate if new_url is None else parts.group(1) + new_url + parts.group(3))
+        start, end = match.start(2) - match.start(), match.end(2) - match.start()
+        return match.group(0)[:start] + ','.join(candidates) + match.group(0)[end:]
+
+    if escaped:
+        text = ATTRIBUTE_URL_RE.sub(replace_attribute, text)
+        text = SRCSET_RE.sub(replace_srcset, text)
+    return CSS_URL_RE.sub(replace_css_url, text)
+
+def rewrite_manifest(text, opf_name, renames):
+    """
+    Aggiorna l'OPF: href e media-type degli elementi del manifest che puntano a
+    membri rinominati, oltre agli altri riferimenti (ad esempio nella guide).
+    """
+    def replace_item(match):
+        item = match.group(0)
+        href = HREF_RE.search(item)
+        if not href:
+            return item
+        target = resolve_reference(opf_name, html.unescape(href.group(3)).strip())
+        if target not in renames:
+            return item
+        media_type = MEDIA_TYPES.get(posixpath.splitext(renames[target])[1].lower())
+        if media_type is None:
+            return item
+        return MEDIA_TYPE_RE.sub(lambda m: m.group(1) + m.group(2) + media_type + m.group(2), item)
+
+    text = MANIFEST_ITEM_RE.sub(replace_item, text)
+    return rewrite_references(text, opf_name, renames)
+
+def rewrite_text_member(member_name, data, renames):
+    """
+    Aggiorna i riferimenti ai membri rinominati in un membro testuale dell'EPUB.
+    Restituisce i nuovi byte, identici agli originali se non c'è nulla da cambiare.
+    """
+    text = data.decode('utf-8', errors='surrogateescape')
+    if member_name.lower().endswith('.opf'):
+        new_text = rewrite_manifest(text, member_name, renames)
+    else:
+        new_text = rewrite_references(text, member_name, renames)
+    if new_text == text:
+        return data
+    return new_text.encode('utf-8', errors='surrogateescape')
+
+def read_text(zip_in, name):
+    """
+    Legge un membro testuale dell'EPUB, conservando gli eventuali byte non UTF-8.
+    """
+    return zip_in.read(name).decode('utf-8', errors='surrogateescape')
+
+def find_opf(zip_in):
+    """
+    Restituisce il nome del pacchetto OPF indicato in container.xml, oppure None.
+    """
+    try:
+        container = read_text(zip_in, CONTAINER_NAME)
+    except KeyError:
+        return None
+    match = ROOTFILE_RE.search(container)
+    return match.group(2).strip() if match else None
+
+def package_version(opf_text):
+    """
+    Restituisce la versione principale del pacchetto OPF (2 o 3), oppure None.
+    """
+    match = PACKAGE_VERSION_RE.search(opf_text)
+    return int(match.group(2)) if match else None
+
+def package_identifiers(opf_text):
+    """
+    Restituisce l'identificatore univoco del pacchetto OPF, oppure None, e l'elenco
+    di tutti i dc:identifier nell'ordine del documento.
+    """
+    unique_id = UNIQUE_IDENTIFIER_RE.search(opf_text)
+    unique_identifier = None
+    identifiers = []
+    for attributes, value in IDENTIFIER_RE.findall(opf_text):
+        value = html.unescape(value).strip()
+        identifiers.append(value)
+        element_id = ID_RE.search(attributes)
+        if unique_id and element_id and element_id.group(2) == unique_id.group(2):
+            unique_identifier = value
+    return unique_identifier, identifiers
+
+def obfuscation_key(algorithm, unique_identifier, identifiers):
+    """
+    Calcola la chiave di offuscamento dei font: SHA-1 dell'identificatore univoco
+    senza spazi per l'algoritmo IDPF, i 16 byte del primo identificatore urn:uuid
+    per quello Adobe. Restituisce None se l'identificatore necessario manca.
+    """
+    if algorithm == IDPF_OBFUSCATION:
+        if not unique_identifier:
+            return None
+        return hashlib.sha1(re.sub(r'[ \t\r\n]', '', unique_identifier).encode('utf-8')).digest()
+    for identifier in [unique_identifier] + identifiers:
+        if identifier and identifier.lower().startswith('urn:uuid:'):
+            digits = re.sub(r'[^0-9a-fA-F]', '', identifier[len('urn:uuid:'):])
+            if len(digits) == 32:
+                return bytes.fromhex(digits)
+    return None
+
+def font_obfuscation(zip_in):
+    """
+    Legge da encryption.xml i membri offuscati o cifrati.
+    Restituisce un dizionario nome del membro -> (algoritmo, chiave): la chiave è
+    None per gli algoritmi diversi dall'offuscamento IDPF o Adobe (DRM) e quando
+    non può essere calcolata, e in questi casi il membro non va modificato.
+    """
     try:
-        # Estrai l'EPUB
-        with zipfile.ZipFile(epub_file, 'r') as zip_ref:
-            zip_ref.extractall(temp_dir)
+        encryption = read_text(zip_in, ENCRYPTION_NAME)
+    except KeyError:
+        return {}
+    opf_text = ''
+    opf_name = find_opf(zip_in)
+    if opf_name:
+        try:
+            opf_text = read_text(zip_in, opf_name)
+        except KeyError:
+            pass
+    unique_identifier, identifiers = package_identifiers(opf_text)
+
+    obfuscation = {}
+    for block in ENCRYPTED_DATA_RE.findall(encryption):
+        algorithm = ALGORITHM_RE.search(block)
+        uri = CIPHER_URI_RE.search(block)
+        if not uri:
+            continue
+        algorithm = algorithm.group(2).strip() if algorithm else None
+        key = obfuscation_key(algorithm, unique_identifier, identifiers) if algorithm in OBFUSCATED_BYTES else None
+        obfuscation[posixpath.normpath(urllib.parse.unquote(uri.group(2).strip()))] = (algorithm, key)
+    return obfuscation
+
+def obfuscate_font(data, algorithm, key):
+    """
+    Applica o rimuove, con la stessa operazione, l'offuscamento di un font: XOR
+    dei primi byte con la chiave ripetuta.
+    """
+    length = min(OBFUSCATED_BYTES[algorithm], len(data))
+    head = np.frombuffer(data[:length], dtype=np.uint8) ^ np.resize(np.frombuffer(key, dtype=np.uint8), length)
+    return head.tobytes() + data[length:]
+
+def text_characters(text):
+    """
+    Restituisce i caratteri di un testo, con le varianti maiuscole e minuscole che
+    text-transform potrebbe mostrare.
+    """
+    return set(text + text.upper() + text.lower())
+
+def css_unescape(text):
+    """
+    Decodifica gli escape CSS di un testo: quelli esadecimali (\\201C), seguiti
+    eventualmente da uno spazio, e quelli di un singolo carattere (\\").
+    La barra seguita da un a capo, che nelle stringhe continua la riga, viene rimossa.
+    """
+    def decode(match):
+        if match.group(2) is not None:
+            return '' if match.group(2) in '\r\n\f' else match.group(2)
+        codepoint = int(match.group(1), 16)
+        if codepoint == 0 or 0xD800 <= codepoint <= 0xDFFF or codepoint > 0x10FFFF:
+            return '\ufffd'
+        return chr(codepoint)
+    return CSS_ESCAPE_RE.sub(decode, text)
+
+def document_text(xhtml):
+    """
+    Estrae il testo di un documento XHTML, senza tag, commenti, script e stili.
+    """
+    return html.unescape(NON_TEXT_RE.sub(' ', xhtml))
+
+def css_families(css, families):
+    """
+    Restituisce le famiglie, tra quelle indicate (in minuscolo), usate nelle
+    proprietà font e font-family di un foglio di stile, esclusi i blocchi @font-face.
+    """
+    css = FONT_FACE_RE.sub(' ', CSS_COMMENT_RE.sub(' ', css))
+    used = set()
+    for value in FONT_DECLARATION_RE.findall(css):
+        value = css_unescape(value).lower()
+        for family in families:
+            if re.search(r'(?<![\w-])' + re.escape(family) + r'(?![\w-])', value):
+                used.add(family)
+    return used
+
+def collect_font_codepoints(zip_in, members):
+    """
+    Raccoglie i caratteri da mantenere in ogni font incorporato, leggendo una sola
+    volta i documenti XHTML e i CSS.
+    Le famiglie sono quelle delle regole @font-face dei CSS e dei blocchi <style>.
+    Ogni documento contribuisce con il proprio testo a tutte le famiglie usate dai
+    suoi stili: fogli collegati e importati, blocchi <style> e attributi style.
+    Una famiglia dichiarata ma non trovata in nessuno stile riceve il testo di tutto
+    il libro, e tutti i font ricevono i testi delle proprietà content dei CSS.
+    Restituisce un dizionario nome del font -> insieme dei codepoint; i font non
+    dichiarati in nessuna @font-face non compaiono.
+    """
+    names = {info.filename for info in members}
+    stylesheets = {info.filename: read_text(zip_in, info.filename)
+                   for info in members if info.filename.lower().endswith('.css')}
+    documents = {info.filename: read_text(zip_in, info.filename)
+                 for info in members if info.filename.lower().endswith(('.xhtml', '.html', '.htm'))}
+
+    # Famiglie dichiarate (in minuscolo) -> font a cui si riferiscono
+    sources = list(stylesheets.items())
+    sources += [(name, block) for name, text in documents.items() for block in STYLE_BLOCK_RE.findall(text)]
+    font_faces = {}
+    extra_text = FONT_EXTRA_TEXT
+    for name, css in sources:
+        css = CSS_COMMENT_RE.sub(' ', css)
+        for rule in FONT_FACE_RE.findall(css):
+            family = FONT_FAMILY_RE.search(rule)
+            if not family:
+                continue
+            for match in CSS_URL_RE.finditer(rule):
+                target = resolve_reference(name, match.group(3))
+                if target in names:
+                    font_faces.setdefault(css_unescape(family.group(2)).strip().lower(), set()).add(target)
+        extra_text += ''.join(css_unescape(content) for _, content in CSS_CONTENT_RE.findall(css))
+
+    usage = {family: set() for family in font_faces}
+    book_characters = set()
+    for name, text in documents.items():
+        styles = STYLE_BLOCK_RE.findall(text) + [style for _, style in STYLE_ATTRIBUTE_RE.findall(text)]
+        # Fogli di stile collegati dal documento e quelli importati, ricorsivamente
+        pending = [(name, match[2]) for match in ATTRIBUTE_URL_RE.findall(text)]
+        pending += [(name, match[1]) for block in styles for match in CSS_IMPORT_RE.findall(block)]
+        visited = set()
+        while pending:
+            base, url = pending.pop()
+            css_name = resolve_reference(base, url)
+            if css_name in visited or css_name not in stylesheets:
+                continue
+            visited.add(css_name)
+            styles.append(stylesheets[css_name])
+            pending += [(css_name, match[1]) for match in CSS_IMPORT_RE.findall(stylesheets[css_name])]
+
+        characters = text_characters(document_text(text))
+        book_characters |= characters
+        for family in css_families('\n'.join(styles), font_faces):
+            usage[family] |= characters
+
+    extra_characters = text_characters(extra_text)
+    codepoints = {}
+    for family, fonts in font_faces.items():
+        characters = (usage[family] or book_characters) | extra_characters
+        for font in fonts:
+            codepoints.setdefault(font, set()).update(ord(character) for character in characters)
+    return codepoints
+
+def subset_font(data, codepoints):
+    """
+    Riduce un font OpenType o TrueType, anche WOFF e WOFF2, ai glifi dei codepoint
+    indicati, mantenendo tutte le funzionalità OpenType (legature, crenatura,
+    varianti) e la tabella dei nomi, nello stesso formato dell'originale.
+    """
+    options = font_subset.Options()
+    options.layout_features = ['*']
+    options.name_IDs = ['*']
+    options.name_languages = ['*']
+    options.notdef_outline = True
+    output = io.BytesIO()
+    with TTFont(io.BytesIO(data)) as font:
+        options.flavor = font.flavor
+        subsetter = font_subset.Subsetter(options)
+        subsetter.populate(unicodes=codepoints)
+        subsetter.subset(font)
+        font_subset.save_font(font, output, options)
+    return output.getvalue()
+
+def compress_font(data, filename, codepoints, obfuscation=None):
+    """
+    Riduce un font incorporato ai caratteri usati. Un font offuscato, con
+    obfuscation (algoritmo, chiave), viene ripristinato prima della riduzione e
+    offuscato di nuovo con la stessa chiave.
+    Restituisce i nuovi byte, oppure None se il font deve restare invariato: quando
+    la riduzione non lo rimpicciolisce e in caso di errore.
+    """
+    try:
+        font_data = obfuscate_font(data, *obfuscation) if obfuscation else data
+        compressed = subset_font(font_data, codepoints)
+        if obfuscation:
+            compressed = obfuscate_font(compressed, *obfuscation)
+        if len(compressed) >= len(data):
+            return None
+        return compressed
+    except Exception as e:
+        print(f"{Fore.RED}Errore durante la riduzione del font {filename}: {e}")
+        return None
+
+def manifest_items(opf_text, opf_name):
+    """
+    Restituisce gli elementi del manifest dell'OPF come dizionario id -> (membro, tag).
+    """
+    items = {}
+    for item in MANIFEST_ITEM_RE.findall(opf_text):
+        href = HREF_RE.search(item)
+        item_id = ID_RE.search(item)
+        if href and item_id:
+            items[item_id.group(2)] = (resolve_reference(opf_name, html.unescape(href.group(3).strip())), item)
+    return items
+
+def member_references(member_name, text):
+    """
+    Restituisce i membri a cui rimanda un documento XHTML, NCX, SVG, SMIL o CSS:
+    attributi src, href e simili, srcset, url() e @import dei CSS.
+    """
+    urls = [match[2] for match in ATTRIBUTE_URL_RE.findall(text)]
+    urls += [match[2] for match in CSS_URL_RE.findall(text)]
+    urls += [match[1] for match in CSS_IMPORT_RE.findall(text)]
+    for _, srcset in SRCSET_RE.findall(text):
+        urls += [candidate.split()[0] for candidate in srcset.split(',') if candidate.split()]
+    return {resolve_reference(member_name, html.unescape(url.strip())) for url in urls} - {None}
+
+def find_orphans(zip_in, members, opf_name):
+    """
+    Individua le risorse (immagini, font, CSS, script, audio e video) che nessuno usa.
+    Il grafo dei riferimenti parte da tutti i membri che non sono risorse (documenti
+    XHTML, NCX, META-INF), dalle voci dello spine, dal nav, dalla copertina, dai
+    fallback del manifest e dagli altri riferimenti dell'OPF (ad esempio la guide), e
+    segue i riferimenti di XHTML, CSS, NCX, SVG e SMIL.
+    Restituisce i nomi delle risorse non raggiungibili, nell'ordine dell'archivio.
+    """
+    names = {info.filename for info in members}
+    opf_text = read_text(zip_in, opf_name)
+    items = manifest_items(opf_text, opf_name)
+
+    # Radici: membri che non possono essere rimossi e riferimenti dell'OPF
+    candidates = {name for name in names if name.lower().endswith(PRUNE_EXTENSIONS)
+                  and not name.startswith('META-INF/')}
+    pending = [name for name in names if name not in candidates and name != opf_name]
+    ids = [match[1] for tag in ITEMREF_RE.findall(opf_text) for match in ID_REFERENCE_RE.findall(tag)]
+    for item_id, (_, item) in items.items():
+        ids += [match[1] for match in ID_REFERENCE_RE.findall(item)]
+        properties = PROPERTIES_RE.search(item)
+        if properties and {'nav', 'cover-image'} & set(properties.group(2).split()):
+            ids.append(item_id)
+    for meta in COVER_META_RE.findall(opf_text):
+        content = CONTENT_RE.search(meta)
+        if content:
+            # Alcuni libri indicano la copertina con il percorso invece che con l'id
+            ids.append(content.group(2).strip())
+            pending.append(resolve_reference(opf_name, content.group(2).strip()))
+    pending += [items[item_id][0] for item_id in ids if item_id in items]
+    pending += member_references(opf_name, MANIFEST_BLOCK_RE.sub(' ', opf_text))
+
+    reached = set()
+    while pending:
+        name = pending.pop()
+        if name in reached or name not in names:
+            continue
+        reached.add(name)
+        if name.lower().endswith(TEXT_EXTENSIONS):
+            pending += member_references(name, read_text(zip_in, name))
+    return [info.filename for info in members if info.filename in candidates - reached]
+
+def dedup_manifest(text, opf_name, duplicates):
+    """
+    Elimina dal manifest dell'OPF le voci delle immagini duplicate, che non possono
+    puntare allo stesso file della copia mantenuta. I riferimenti ai loro id (spine,
+    fallback, copertina, refines) passano all'id della copia mantenuta, che riceve
+    anche le loro properties (ad esempio cover-image).
+    """
+    items = manifest_items(text, opf_name)
+    member_ids = {member: item_id for item_id, (member, _) in items.items()}
+    id_aliases = {}
+    extra_properties = {}
+    for item_id, (member, item) in items.items():
+        kept = duplicates.get(member)
+        if kept not in member_ids:
+            continue
+        id_aliases[item_id] = member_ids[kept]
+        properties = PROPERTIES_RE.search(item)
+        if properties:
+            extra_properties.setdefault(member_ids[kept], []).extend(properties.group(2).split())
+    if not id_aliases:
+        return text
+
+    def replace_item(match):
+        item = match.group(0)
+        item_id = ID_RE.search(item)
+        item_id = item_id.group(2) if item_id else None
+        if item_id in id_aliases:
+            return ''
+        if item_id not in extra_properties:
+            return item
+        properties = PROPERTIES_RE.search(item)
+        tokens = properties.group(2).split() if properties else []
+        tokens += [token for token in extra_properties[item_id] if token not in tokens]
+        if properties:
+            return item[:properties.start(2)] + ' '.join(tokens) + item[properties.end(2):]
+        return re.sub(r"^(\s*<(?:opf:)?item\b)", lambda m: f'{m.group(1)} properties="{" ".join(tokens)}"', item)
+
+    def replace_id(match):
+        if match.group(2) not in id_aliases:
+            return match.group(0)
+        start, end = match.start(2) - match.start(), match.end(2) - match.start()
+        return match.group(0)[:start] + id_aliases[match.group(2)] + match.group(0)[end:]
+
+    text = MANIFEST_ELEMENT_RE.sub(replace_item, text)
+    text = ID_REFERENCE_RE.sub(replace_id, text)
+    text = REFINES_RE.sub(replace_id, text)
+    return COVER_META_RE.sub(lambda match: CONTENT_RE.sub(replace_id, match.group(0)), text)
+
+def prune_text_member(member_name, data, opf_name, dropped):
+    """
+    Elimina i riferimenti alle risorse rimosse dal manifest dell'OPF e da
+    encryption.xml. Restituisce i nuovi byte, identici agli originali se non c'è
+    nulla da cambiare.
+    """
+    text = data.decode('utf-8', errors='surrogateescape')
+
+    def remove_item(match):
+        href = HREF_RE.search(match.group(0))
+        if href and resolve_reference(opf_name, html.unescape(href.group(3).strip())) in dropped:
+            return ''
+        return match.group(0)
+
+    def remove_encrypted_data(match):
+        uri = CIPHER_URI_RE.search(match.group(0))
+        if uri and posixpath.normpath(urllib.parse.unquote(uri.group(2).strip())) in dropped:
+            return ''
+        return match.group(0)
+
+    if member_name == opf_name:
+        new_text = MANIFEST_ELEMENT_RE.sub(remove_item, text)
+    elif member_name == ENCRYPTION_NAME:
+        new_text = ENCRYPTED_DATA_RE.sub(remove_encrypted_data, text)
+    else:
+        return data
+    if new_text == text:
+        return data
+    return new_text.encode('utf-8', errors='surrogateescape')
+
+def minify_css_code(code):
+    """
+    Minifica un tratto di CSS privo di stringhe e commenti: spazi ridotti a uno e
+    tolti attorno alla punteggiatura che non ne ha bisogno.
+    """
+    code = re.sub(r"\s+", " ", code)
+    code = re.sub(r"\s*([{};,>])\s*", r"\1", code)
+    code = re.sub(r":\s+", ":", code)
+    return re.sub(r";+}", "}", code)
+
+def merge_declarations(body):
+    """
+    Semplifica le dichiarazioni di una regola CSS: elimina quelle ripetute identiche,
+    tenendo l'ultima, e unisce in margin e padding i quattro lati indicati
+    separatamente. Le regole che non si riesce a dividere con certezza nelle
+    singole dichiarazioni restano invariate. I nomi delle proprietà vengono
+    confrontati senza distinguere maiuscole e minuscole, tranne quelli delle
+    proprietà personalizzate (--nome), ma restano scritti come nell'originale.
+    """
+    def name(prop):
+        return prop if prop.startswith('--') else prop.lower()
+
+    parts = CSS_DECLARATION_RE.findall(body)
+    if ';'.join(parts) != body:
+        return body
+    declarations = []
+    for declaration in parts:
+        prop, colon, value = declaration.partition(':')
+        if not colon:
+            return body
+        declarations.append((prop.strip(), value.strip()))
+
+    # Dichiarazioni identiche: conta solo l'ultima
+    keys = [(name(prop), value) for prop, value in declarations]
+    declarations = [declaration for i, declaration in enumerate(declarations)
+                    if keys[i] not in keys[i + 1:]]
+
+    for box in ('margin', 'padding'):
+        sides = {name(prop): value for prop, value in declarations
+                 if name(prop) == box or name(prop).startswith(box + '-')}
+        longhands = [f"{box}-{side}" for side in BOX_SIDES]
+        related = [name(prop) for prop, _ in declarations if name(prop) == box or name(prop).startswith(box + '-')]
+        if sorted(related) != sorted(longhands) or any('!' in sides[prop] or ' ' in sides[prop] for prop in longhands):
+            continue
+        top, right, bottom, left = (sides[prop] for prop in longhands)
+        values = [top, right, bottom, left]
+        if right == left:
+            values = values[:3]
+            if top == bottom:
+                values = values[:2]
+                if top == right:
+                    values = values[:1]
+        first = min(i for i, (prop, _) in enumerate(declarations) if name(prop) in longhands)
+        declarations = [(box, ' '.join(values)) if i == first else declaration
+                        for i, declaration in enumerate(declarations)
+                        if i == first or name(declaration[0]) not in longhands]
+
+    return ';'.join(f"{prop}:{value}" for prop, value in declarations)
+
+def minify_css(css):
+    """
+    Minifica un foglio di stile: rimuove i commenti, riduce gli spazi fuori dalle
+    stringhe, elimina le dichiarazioni duplicate e usa le forme abbreviate di
+    margin e padding.
+    """
+    output = []
+    braces_in_strings = False
+    pos = 0
+    for match in CSS_TOKEN_RE.finditer(css):
+        output.append(minify_css_code(css[pos:match.start()]))
+        # I commenti vengono eliminati, le stringhe copiate così come sono
+        if match.group(1):
+            output.append(match.group(1))
+            braces_in_strings = braces_in_strings or '{' in match.group(1) or '}' in match.group(1)
+        pos = match.end()
+    output.append(minify_css_code(css[pos:]))
+    css = ''.join(output).strip()
+    # Con parentesi graffe nelle stringhe le regole non si possono individuare con certezza
+    if braces_in_strings:
+        return css
+    return CSS_RULE_RE.sub(lambda match: match.group(1) + '{' + merge_declarations(match.group(2)) + '}', css)
+
+def minify_xhtml(text, collapse_whitespace=True):
+    """
+    Minifica un documento XHTML: rimuove i commenti, riduce gli spazi tra gli
+    attributi e, con collapse_whitespace, riduce a uno le sequenze di spazi nel
+    testo, mantenendo un a capo se la sequenza ne conteneva. Il contenuto di
+    <pre>, <textarea>, <script>, delle sezioni CDATA e degli elementi con
+    xml:space="preserve" (ad esempio <text> negli SVG) resta invariato, quello di
+    <style> viene minificato come CSS.
+    """
+    # Elemento con xml:space="preserve" in corso e quanti elementi omonimi sono aperti
+    preserved, depth = None, 0
+
+    def collapse(segment):
+        if not collapse_whitespace or preserved:
+            return segment
+        return TEXT_SPACE_RE.sub(lambda match: '\n' if '\n' in match.group(0) else ' ', segment)
+
+    def compact_tag(tag):
+        tag = TAG_SPACE_RE.sub(lambda match: match.group(1) or ' ', tag)
+        return re.sub(r"\s+(/?>)$", r"\1", tag)
+
+    output = []
+    pending_text = []
+    pos = 0
+    for match in MARKUP_RE.finditer(text):
+        pending_text.append(text[pos:match.start()])
+        pos = match.end()
+        token = match.group(0)
+        if token.startswith('<!--'):
+            # Il testo prima e dopo il commento viene ridotto come un'unica sequenza
+            continue
+        output.append(collapse(''.join(pending_text)))
+        pending_text = []
+        if match.group(1):
+            element = match.group(1)
+            start_tag = compact_tag(f"<{element}{match.group(2)}>")
+            content = match.group(3)
+            if element.lower() == 'style' and '<' not in content:
+                content = minify_css(content)
+            output.append(f"{start_tag}{content}</{element}>")
+        elif token.startswith('<![CDATA['):
+            output.append(token)
+        else:
+            tag = TAG_NAME_RE.match(token)
+            if tag and not token.endswith('/>'):
+                closing, element = tag.groups()
+                if preserved is None and not closing and XML_SPACE_PRESERVE_RE.search(token):
+                    preserved, depth = element, 1
+                elif element == preserved:
+                    depth += -1 if closing else 1
+                    if depth == 0:
+                        preserved = None
+            output.append(compact_tag(token))
+    pending_text.append(text[pos:])
+    output.append(collapse(''.join(pending_text)))
+    return ''.join(output)
+
+def minify_member(member_name, data, preserve_whitespace=False):
+    """
+    Minifica un membro XHTML o CSS dell'EPUB. Con preserve_whitespace, o se il
+    documento stesso usa white-space: pre*, gli spazi nel testo restano invariati.
+    Restituisce i nuovi byte, identici agli originali se non c'è nulla da cambiare.
+    """
+    text = data.decode('utf-8', errors='surrogateescape')
+    if member_name.lower().endswith('.css'):
+        new_text = minify_css(text)
+    else:
+        collapse_whitespace = not (preserve_whitespace or WHITE_SPACE_PRE_RE.search(text))
+        new_text = minify_xhtml(text, collapse_whitespace)
+    if new_text == text:
+        return data
+    return new_text.encode('utf-8', errors='surrogateescape')
+
+def ordered_members(members):
+    """
+    Restituisce i membri nell'ordine di scrittura: container.xml per primo (dopo il
+    mimetype, scritto a parte) e poi gli altri nell'ordine dell'archivio originale.
+    Il mimetype originale viene escluso.
+    """
+    members = [info for info in members if info.filename != MIMETYPE_NAME]
+    return sorted(members, key=lambda info: info.filename != CONTAINER_NAME)
+
+def write_mimetype(zip_out):
+    """
+    Scrive il membro mimetype come richiesto dall'OCF: primo, non compresso e senza
+    campi extra, così che i lettori possano riconoscere l'EPUB dai primi byte.
+    """
+    info = zipfile.ZipInfo(MIMETYPE_NAME, date_time=ZIP_DATE_TIME)
+    info.compress_type = zipfile.ZIP_STORED
+    # Attributi fissi, indipendenti dal sistema operativo su cui gira lo script
+    info.create_system = 0
+    zip_out.writestr(info, EPUB_MIMETYPE)
+
+def copy_zipinfo(info, filename=None):
+    """
+    Crea un nuovo ZipInfo per l'archivio di output con nome e attributi del membro
+    originale e la data normalizzata a ZIP_DATE_TIME.
+    Con filename il membro viene rinominato.
+    """
+    new_info = zipfile.ZipInfo(filename or info.filename, date_time=ZIP_DATE_TIME)
+    new_info.compress_type = info.compress_type
+    new_info.create_system = info.create_system
+    new_info.external_attr = info.external_attr
+    new_info.comment = info.comment
+    new_info.file_size = info.file_size
+    return new_info
+
+def deflate(data, level=DEFAULT_ZIP_LEVEL, backend='zlib'):
+    """
+    Comprime i byte in un flusso deflate grezzo, senza header zlib, come richiesto
+    dal formato ZIP. Il livello va da 1 (veloce) a 9 (massimo): ISA-L lo riporta
+    ai suoi livelli 0-3, zopfli lo ignora ed esegue sempre ZOPFLI_ITERATIONS
+    iterazioni, molto più lente ma con un risultato più piccolo di zlib -9.
+    """
+    if backend == 'zopfli':
+        # zopfli produce un flusso zlib: si tolgono header (2 byte) e checksum (4 byte)
+        return zopfli.zopfli.compress(data, numiterations=ZOPFLI_ITERATIONS, gzip_mode=0)[2:-4]
+    if backend == 'isal':
+        module, level = isal_zlib, level * ISAL_MAX_LEVEL // 9
+    elif backend == 'zlib-ng':
+        module = zlib_ng
+    else:
+        module = zlib
+    compressor = module.compressobj(level, module.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+def should_deflate(filename, data):
+    """
+    Indica se conviene comprimere un membro con deflate: i formati già compressi
+    vengono salvati così come sono, e per i membri più grandi di DEFLATE_SAMPLE_SIZE
+    si comprime prima, al livello più veloce, un campione preso a metà dei dati.
+    """
+    if filename.lower().endswith(STORED_EXTENSIONS):
+        return False
+    if len(data) <= DEFLATE_SAMPLE_SIZE:
+        return True
+    start = (len(data) - DEFLATE_SAMPLE_SIZE) // 2
+    sample = data[start:start + DEFLATE_SAMPLE_SIZE]
+    return len(zlib.compress(sample, 1)) < len(sample) * (1 - DEFLATE_MIN_GAIN)
+
+def zip_backend_available(backend):
+    """
+    Indica se il modulo del backend deflate indicato è installato.
+    """
+    modules = {'zlib': zlib, 'zlib-ng': zlib_ng, 'isal': isal_zlib, 'zopfli': zopfli}
+    return modules[backend] is not None
+
+def write_raw_member(zip_out, new_info, chunks):
+    """
+    Scrive nell'archivio di output un membro i cui dati sono già compressi con il
+    metodo indicato in new_info, che deve contenere anche CRC e dimensioni.
+    """
+    # CRC e dimensioni vanno nell'header locale, quindi niente data descriptor
+    new_info.flag_bits &= ~DATA_DESCRIPTOR_FLAG
+    new_info.header_offset = zip_out.fp.tell()
+    zip_out.fp.write(new_info.FileHeader())
+    for chunk in chunks:
+        zip_out.fp.write(chunk)
 
-        # Trova tutte le immagini
-        image_paths = []
-        for root, _, files in os.walk(temp_dir):
+    # Registra il membro come se fosse stato scritto da ZipFile
+    zip_out.filelist.append(new_info)
+    zip_out.NameToInfo[new_info.filename] = new_info
+    zip_out.start_dir = zip_out.fp.tell()
+    zip_out._didModify = True
+
+def write_member(zip_out, new_info, data, level=DEFAULT_ZIP_LEVEL, backend='zlib', max_size=None):
+    """
+    Scrive un membro comprimendolo con il backend deflate indicato. Se il formato è
+    già compresso, se il campione provato da should_deflate non si riduce abbastanza
+    o se la compressione non riduce i dati il membro viene salvato senza compressione
+    (STORED), più veloce da scrivere e da leggere.
+    Con max_size il membro viene scritto solo se occupa meno di max_size byte
+    nell'archivio: restituisce False se non è stato scritto, altrimenti True.
+    """
+    compressed = deflate(data, level, backend) if should_deflate(new_info.filename, data) else data
+    if len(compressed) < len(data):
+        new_info.compress_type = zipfile.ZIP_DEFLATED
+    else:
+        compressed = data
+        new_info.compress_type = zipfile.ZIP_STORED
+    if max_size is not None and len(compressed) >= max_size:
+        return False
+    new_info.file_size = len(data)
+    new_info.compress_size = len(compressed)
+    new_info.CRC = zlib.crc32(data)
+    write_raw_member(zip_out, new_info, [compressed])
+    return True
+
+def read_raw_chunks(zip_in, info):
+    """
+    Legge a blocchi i dati compressi di un membro, senza decomprimerli.
+    """
+    # Salta l'header locale per posizionarsi all'inizio dei dati compressi
+    zip_in.fp.seek(info.header_offset)
+    header = zip_in.fp.read(LOCAL_HEADER_SIZE)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    zip_in.fp.seek(info.header_offset + LOCAL_HEADER_SIZE + name_length + extra_length)
+
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = zip_in.fp.read(min(COPY_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise EOFError(f"Dati troncati per {info.filename}")
+        yield chunk
+        remaining -= len(chunk)
+
+def copy_raw_member(zip_in, zip_out, info):
+    """
+    Copia un membro nell'archivio di output senza decomprimerlo né ricomprimerlo:
+    i byte già compressi, il CRC e il metodo di compressione restano quelli originali.
+    """
+    new_info = copy_zipinfo(info)
+    new_info.CRC = info.CRC
+    new_info.compress_size = info.compress_size
+    new_info.create_version = info.create_version
+    new_info.extract_version = info.extract_version
+    new_info.flag_bits = info.flag_bits
+    write_raw_member(zip_out, new_info, read_raw_chunks(zip_in, info))
+
+def copy_member(zip_in, zip_out, info, data=None, recompress=False, level=DEFAULT_ZIP_LEVEL, backend='zlib'):
+    """
+    Copia un membro invariato nell'archivio di output. Con recompress viene
+    ricompresso con il livello e il backend indicati, ma i dati compressi originali
+    vengono copiati così come sono se occupano meno spazio. data evita di rileggere
+    un membro già decompresso.
+    """
+    if recompress:
+        if data is None:
+            data = zip_in.read(info)
+        replace_member(zip_in, zip_out, info, data, level, backend)
+    else:
+        copy_raw_member(zip_in, zip_out, info)
+
+def replace_member(zip_in, zip_out, info, data, level=DEFAULT_ZIP_LEVEL, backend='zlib'):
+    """
+    Scrive i nuovi dati di un membro con lo stesso nome, ma copia il membro originale
+    così come è se i suoi dati compressi occupano meno spazio nell'archivio.
+    Restituisce True se sono stati scritti i nuovi dati, False se è rimasto l'originale.
+    """
+    # Metodi diversi da STORED e DEFLATED non sono ammessi dall'OCF: si riscrive sempre
+    max_size = info.compress_size if info.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) else None
+    if write_member(zip_out, copy_zipinfo(info), data, level, backend, max_size):
+        return True
+    copy_raw_member(zip_in, zip_out, info)
+    return False
+
+class ImageCache:
+    """
+    Cache su disco delle immagini compresse, indicizzata dall'hash del contenuto
+    originale, dal formato e dai parametri di compressione.
+    Quando supera max_size byte vengono eliminate le voci usate meno di recente.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, data, filename, image_options):
+        """
+        Calcola la chiave di un'immagine per i parametri di compressione dati.
+        """
+        params = {
+            'version': CACHE_VERSION,
+            'pillow': PIL.__version__,
+            'format': os.path.splitext(filename)[1].lower(),
+            'options': image_options,
+        }
+        digest = hashlib.sha256(hashlib.sha256(data).digest())
+        digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """
+        Restituisce una coppia (trovato, risultato), dove risultato è quello di
+        compress_image: i byte compressi con l'estensione e i metadati rimossi, oppure
+        None se l'immagine va lasciata invariata.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = f.read()
+            # La data di modifica indica l'ultimo utilizzo per l'eliminazione LRU
+            os.utime(path)
+        except OSError:
+            return False, None
+        header, _, data = entry.partition(b'\n')
+        if not header:
+            return True, None
+        header = json.loads(header)
+        return True, (data, header['extension'], header['metadata'])
+
+    def put(self, key, result):
+        """
+        Salva il risultato di compress_image associato alla chiave.
+        La scrittura è atomica, così più processi possono condividere la cache.
+        """
+        path = self._path(key)
+        header = b''
+        data = b''
+        if result:
+            data, extension, metadata_savings = result
+            header = json.dumps({'extension': extension, 'metadata': metadata_savings}).encode('utf-8')
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header + b'\n' + data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"{Fore.YELLOW}Impossibile salvare nella cache {path}: {e}")
+
+    def evict(self):
+        """
+        Elimina le voci usate meno di recente finché la cache non rientra in max_size.
+        """
+        entries = []
+        total_size = 0
+        for root, _, files in os.walk(self.directory):
             for file in files:
-                if file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                    image_paths.append(os.path.join(root, file))
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+
+def compress_images(zip_in, image_infos, image_options, workers=1, show_progress=True, cache=None):
+    """
+    Comprime le immagini dell'EPUB, distribuendole su più processi se workers > 1.
+    Le immagini già presenti nella cache non vengono ricompresse.
+    Le immagini vengono lette dall'archivio una alla volta, solo quando servono, e nel
+    pool ne restano in attesa al massimo IMAGE_QUEUE_PER_WORKER per processo, così la
+    memoria del processo principale non cresce con il numero di immagini del libro.
+    Restituisce un dizionario nome del membro -> (byte compressi, estensione, metadati
+    rimossi per categoria), così che l'archivio di output possa essere scritto
+    nell'ordine originale indipendentemente dall'ordine di completamento. Le
+    immagini rimaste invariate non compaiono nel dizionario.
+    """
+    results = {}
+    with tqdm(total=len(image_infos), desc=f"Compressione immagini", unit="immagine",
+              disable=not show_progress) as pbar:
+        def pending():
+            # Recupera dalla cache le immagini già compresse con gli stessi parametri
+            for info in image_infos:
+                data = zip_in.read(info)
+                key = cache.key(data, info.filename, image_options) if cache else None
+                found, cached = cache.get(key) if cache else (False, None)
+                if found:
+                    if cached:
+                        results[info.filename] = cached
+                    pbar.update(1)
+                else:
+                    yield info.filename, data, key
 
-        # Comprimi le immagini
-        with tqdm(total=len(image_paths), desc=f"Compressione immagini", unit="immagine") as pbar:
-            for image_path in image_paths:
-                compress_image(image_path, quality)
+        def store(filename, key, compressed):
+            if cache:
+                cache.put(key, compressed)
+            if compressed:
+                results[filename] = compressed
+            pbar.update(1)
+
+        if workers > 1 and len(image_infos) > 1:
+            # Processi e non thread: gli encoder di Pillow trattengono il GIL
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {}
+                for filename, data, key in pending():
+                    if len(futures) >= workers * IMAGE_QUEUE_PER_WORKER:
+                        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            store(*futures.pop(future), future.result())
+                    futures[executor.submit(compress_image, data, filename, **image_options)] = (filename, key)
+                for future in as_completed(futures):
+                    store(*futures[future], future.result())
+        else:
+            for filename, data, key in pending():
+                store(filename, key, compress_image(data, filename, **image_options))
+    return results
+
+def compress_fonts(zip_in, members, workers=1, show_progress=True):
+    """
+    Riduce i font incorporati nell'EPUB ai caratteri usati nel libro, distribuendoli
+    su più processi se workers > 1. I font cifrati con algoritmi diversi
+    dall'offuscamento IDPF o Adobe, o di cui manca la chiave, restano invariati.
+    Restituisce un dizionario nome del membro -> byte ridotti; i font rimasti
+    invariati non compaiono nel dizionario.
+    """
+    codepoints = collect_font_codepoints(zip_in, members)
+    obfuscation = font_obfuscation(zip_in)
+    pending = []
+    for info in members:
+        if info.filename not in codepoints:
+            continue
+        algorithm, key = obfuscation.get(info.filename, (None, None))
+        if algorithm and key is None:
+            continue
+        pending.append((info.filename, zip_in.read(info), (algorithm, key) if key else None))
+
+    results = {}
+    with tqdm(total=len(pending), desc="Riduzione font", unit="font", disable=not show_progress) as pbar:
+        if workers > 1 and len(pending) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(compress_font, data, filename, codepoints[filename], font_key): filename
+                    for filename, data, font_key in pending
+                }
+                for future in as_completed(futures):
+                    compressed = future.result()
+                    if compressed:
+                        results[futures[future]] = compressed
+                    pbar.update(1)
+        else:
+            for filename, data, font_key in pending:
+                compressed = compress_font(data, filename, codepoints[filename], font_key)
+                if compressed:
+                    results[filename] = compressed
                 pbar.update(1)
+    return results
+
+def compress_epub(epub_file, image_options, output_dir, workers=1, show_progress=True, cache=None,
+                  zip_level=None, zip_backend='zlib', subset_fonts=False, minify=False, prune=None,
+                  dedup=None):
+    """
+    Comprime un file EPUB, applicando la compressione alle immagini e, con
+    subset_fonts, riducendo i font incorporati ai caratteri usati. Con minify i
+    documenti XHTML e i CSS vengono minificati, uno alla volta durante la scrittura.
+    Con prune le risorse che nessuno usa vengono segnalate ('report') oppure
+    eliminate, insieme alle loro voci nel manifest ('drop'), prima di comprimerle.
+    Con dedup le immagini duplicate, identiche ('exact') o anche solo simili
+    ('perceptual'), vengono sostituite da un'unica copia: viene compressa solo
+    quella, e manifest e riferimenti vengono aggiornati.
+    I membri vengono letti dall'archivio originale e scritti direttamente in quello
+    compresso, senza estrarre nulla su disco: solo le immagini vengono decodificate
+    e ricodificate in memoria, gli altri membri sono copiati senza ricomprimerli.
+    L'archivio viene costruito in una directory temporanea propria di ogni libro,
+    così più compressioni possono girare in parallelo senza interferire.
+    Il mimetype viene scritto per primo e non compresso, come richiesto dall'OCF,
+    e le date dei membri sono normalizzate: gli stessi input producono un EPUB
+    identico byte per byte.
+    I membri nuovi o modificati vengono compressi con zip_backend al livello
+    zip_level; se uno dei due è indicato anche i membri invariati vengono
+    ricompressi, quando così occupano meno spazio.
+    """
+    print(f"\n{Fore.YELLOW}Inizio compressione: {epub_file}")
 
-        # Crea il nuovo file EPUB compresso
-        with zipfile.ZipFile(temp_compressed_file, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
-            for root, _, files in os.walk(temp_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, temp_dir)
-                    zip_ref.write(file_path, arcname)
+    initial_size = os.path.getsize(epub_file)
+    work_dir = tempfile.mkdtemp(prefix="epubcomp_")
+    temp_compressed_file = os.path.join(work_dir, os.path.basename(epub_file))
+
+    try:
+        with zipfile.ZipFile(epub_file, 'r') as zip_in, \
+                zipfile.ZipFile(temp_compressed_file, 'w', zipfile.ZIP_DEFLATED) as zip_out:
+            members = zip_in.infolist()
+
+            # Individua le risorse che nessun documento usa
+            opf_name = find_opf(zip_in)
+            orphans = []
+            if prune and opf_name in zip_in.NameToInfo:
+                orphans = find_orphans(zip_in, members, opf_name)
+                for name in orphans:
+                    print(f"{Fore.YELLOW}Risorsa non referenziata: {name}")
+            elif prune:
+                print(f"{Fore.YELLOW}Pacchetto OPF non trovato, nessuna risorsa rimossa")
+            orphan_bytes = sum(zip_in.getinfo(name).file_size for name in orphans)
+            dropped = set(orphans) if prune == 'drop' else set()
+            members = [info for info in members if info.filename not in dropped]
+
+            # WebP e AVIF sono tipi di risorsa ammessi solo negli EPUB 3
+            convert_to = image_options.get('convert_to')
+            if convert_to and (opf_name not in zip_in.NameToInfo
+                               or (package_version(read_text(zip_in, opf_name)) or 0) < 3):
+                print(f"{Fore.YELLOW}{epub_file} non è un EPUB 3: immagini non convertite in {convert_to}")
+                image_options = dict(image_options, convert_to=None)
+
+            image_infos = [info for info in members if is_image(info.filename)]
+
+            # Cerca le immagini duplicate: si comprime solo la copia mantenuta
+            duplicates = find_duplicate_images(zip_in, image_infos, dedup == 'perceptual') if dedup else {}
+
+            # Comprimi le immagini
+            unique_infos = [info for info in image_infos if info.filename not in duplicates]
+            compressed_images = compress_images(zip_in, unique_infos, image_options, workers, show_progress, cache)
+
+            # Riduci i font ai caratteri usati nel libro
+            font_infos = [info for info in members if info.filename.lower().endswith(FONT_EXTENSIONS)]
+            compressed_fonts = compress_fonts(zip_in, members, workers, show_progress) if subset_fonts else {}
+
+            stats = {
+                'images': len(image_infos),
+                'fonts': len(font_infos) if subset_fonts else 0,
+                'minified': 0,
+                'minify_saved_bytes': 0,
+                'orphans': len(orphans),
+                'orphan_bytes': orphan_bytes,
+                'pruned': bool(dropped),
+                'duplicates': len(duplicates),
+                'duplicate_bytes': sum(info.file_size for info in image_infos if info.filename in duplicates),
+            }
+
+            # Le immagini convertite in un altro formato cambiano nome
+            existing_names = {info.filename for info in members}
+            renames = {}
+            for filename, (_, extension, _) in compressed_images.items():
+                if posixpath.splitext(filename)[1].lower() != extension:
+                    renames[filename] = rename_member(filename, extension, existing_names)
+                    existing_names.add(renames[filename])
+            # I riferimenti ai duplicati puntano alla copia mantenuta, con il suo nuovo nome
+            for filename, kept in duplicates.items():
+                renames[filename] = renames.get(kept, kept)
+
+            recompress = zip_level is not None or zip_backend != 'zlib'
+            level = zip_level or DEFAULT_ZIP_LEVEL
+
+            # Se un CSS usa white-space: pre*, gli spazi nel testo dei documenti sono
+            # significativi; i CSS vengono letti uno alla volta senza conservarli
+            preserve_whitespace = minify and any(
+                WHITE_SPACE_PRE_RE.search(read_text(zip_in, info.filename))
+                for info in members if info.filename.lower().endswith('.css'))
+
+            # Copia i membri nell'EPUB compresso: il mimetype per primo e poi gli altri
+            # in un ordine che dipende solo dall'archivio originale
+            write_mimetype(zip_out)
+            for info in ordered_members(members):
+                if info.filename in duplicates:
+                    continue
+                if info.filename in renames:
+                    new_info = copy_zipinfo(info, renames[info.filename])
+                    write_member(zip_out, new_info, compressed_images[info.filename][0], level, zip_backend)
+                elif info.filename in compressed_images:
+                    # Nello stesso formato resta l'originale se nell'archivio occupava meno spazio
+                    if not replace_member(zip_in, zip_out, info, compressed_images[info.filename][0],
+                                          level, zip_backend):
+                        del compressed_images[info.filename]
+                elif info.filename in compressed_fonts:
+                    if not replace_member(zip_in, zip_out, info, compressed_fonts[info.filename], level, zip_backend):
+                        del compressed_fonts[info.filename]
+                elif ((renames and info.filename.lower().endswith(TEXT_EXTENSIONS))
+                        or (minify and info.filename.lower().endswith(MINIFY_EXTENSIONS))
+                        or (dropped and info.filename in (opf_name, ENCRYPTION_NAME))):
+                    # Aggiorna manifest e riferimenti alle immagini rinominate e alle risorse rimosse
+                    data = zip_in.read(info)
+                    new_data = data
+                    if duplicates and info.filename == opf_name:
+                        text = data.decode('utf-8', errors='surrogateescape')
+                        deduped = dedup_manifest(text, opf_name, duplicates)
+                        if deduped != text:
+                            new_data = deduped.encode('utf-8', errors='surrogateescape')
+                    if renames:
+                        new_data = rewrite_text_member(info.filename, new_data, renames)
+                    if dropped:
+                        new_data = prune_text_member(info.filename, new_data, opf_name, dropped)
+                    if minify and info.filename.lower().endswith(MINIFY_EXTENSIONS):
+                        minified = minify_member(info.filename, new_data, preserve_whitespace)
+                        if minified is not new_data:
+                            stats['minified'] += 1
+                            stats['minify_saved_bytes'] += len(new_data) - len(minified)
+                            new_data = minified
+                    if new_data is data:
+                        copy_member(zip_in, zip_out, info, data, recompress, level, zip_backend)
+                    else:
+                        write_member(zip_out, copy_zipinfo(info), new_data, level, zip_backend)
+                else:
+                    # I membri invariati vengono copiati così come sono o ricompressi
+                    copy_member(zip_in, zip_out, info, None, recompress, level, zip_backend)
+
+            # Conta solo il risparmio reale: le immagini e i font non ridotti restano originali
+            stats.update({
+                'recompressed': len(compressed_images),
+                'saved_bytes': sum(info.file_size - len(compressed_images[info.filename][0])
+                                   for info in image_infos if info.filename in compressed_images),
+                'metadata': {},
+                'subset_fonts': len(compressed_fonts),
+                'font_saved_bytes': sum(info.file_size - len(compressed_fonts[info.filename])
+                                        for info in members if info.filename in compressed_fonts),
+            })
+            for _, _, metadata_savings in compressed_images.values():
+                for category, size in metadata_savings.items():
+                    add_saving(stats['metadata'], category, size)
 
         # Sposta il file compresso nella directory di output
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
+        os.makedirs(output_dir, exist_ok=True)
         final_compressed_file = os.path.join(output_dir, os.path.basename(epub_file))
         shutil.move(temp_compressed_file, final_compressed_file)
 
@@ -74,15 +2245,80 @@ def compress_epub(epub_file, quality, output_dir):
         compression_ratio = (initial_size - final_size) / initial_size * 100 if initial_size > 0 else 0
 
         print(f"{Fore.GREEN}Fine compressione con successo: {epub_file}")
-        return (os.path.basename(epub_file), initial_size, final_size, compression_ratio)
+        return (os.path.basename(epub_file), initial_size, final_size, compression_ratio, stats)
 
     except Exception as e:
         print(f"{Fore.RED}Errore durante la compressione di {epub_file}: {e}")
         return None
     finally:
-        # Rimuovi la directory temporanea
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
+        # Rimuovi la directory temporanea del libro
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def compress_epubs(epub_files, image_options, output_dir, workers=1, jobs=1, cache=None,
+                   zip_level=None, zip_backend='zlib', subset_fonts=False, minify=False, prune=None,
+                   dedup=None):
+    """
+    Comprime più file EPUB, fino a jobs libri contemporaneamente.
+    Se un processo viene terminato, ad esempio dall'OOM killer, i libri che erano in
+    corso vengono ripetuti ognuno in un processo dedicato, così il fallimento
+    riguarda solo il libro che lo ha causato e il batch prosegue.
+    La cache viene riportata entro la dimensione massima ogni CACHE_EVICT_INTERVAL
+    libri e alla fine del batch.
+    Restituisce le informazioni dei file compressi con successo, nell'ordine di epub_files.
+    """
+    def book_done():
+        if cache and len(results) % CACHE_EVICT_INTERVAL == 0:
+            cache.evict()
+
+    results = {}
+    if jobs > 1 and len(epub_files) > 1:
+        # Con più libri in parallelo le barre per immagine si sovrapporrebbero
+        options = (image_options, output_dir, workers, False, cache,
+                   zip_level, zip_backend, subset_fonts, minify, prune, dedup)
+        crashed = []
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(compress_epub, epub_file, *options): epub_file for epub_file in epub_files}
+            with tqdm(total=len(epub_files), desc="Compressione EPUB", unit="libro") as pbar:
+                for future in as_completed(futures):
+                    epub_file = futures[future]
+                    try:
+                        results[epub_file] = future.result()
+                    except BrokenProcessPool:
+                        # Il pool non è più utilizzabile: non si sa quale libro lo abbia interrotto
+                        crashed.append(epub_file)
+                    except Exception as e:
+                        print(f"{Fore.RED}Errore durante la compressione di {epub_file}: {e}")
+                        results[epub_file] = None
+                    else:
+                        book_done()
+                    pbar.update(1)
+
+        for epub_file in sorted(crashed, key=epub_files.index):
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                try:
+                    results[epub_file] = executor.submit(compress_epub, epub_file, *options).result()
+                except Exception as e:
+                    print(f"{Fore.RED}Errore: il processo che comprimeva {epub_file} si è interrotto: {e}")
+                    results[epub_file] = None
+    else:
+        for epub_file in epub_files:
+            results[epub_file] = compress_epub(epub_file, image_options, output_dir, workers, cache=cache,
+                                               zip_level=zip_level, zip_backend=zip_backend,
+                                               subset_fonts=subset_fonts, minify=minify, prune=prune,
+                                               dedup=dedup)
+            book_done()
+    if cache:
+        cache.evict()
+    return [results[epub_file] for epub_file in epub_files if results[epub_file]]
+
+def format_metadata_savings(metadata_savings):
+    """
+    Formatta i byte di metadati rimossi per categoria, nell'ordine di METADATA_CATEGORIES.
+    """
+    total = sum(metadata_savings.values())
+    details = ", ".join(f"{category} {metadata_savings[category] / 1024:.1f} KB"
+                        for category in METADATA_CATEGORIES if metadata_savings.get(category))
+    return f"{total / 1024:.1f} KB ({details})"
 
 def print_report(files_info):
     """
@@ -90,13 +2326,51 @@ def print_report(files_info):
     """
     print(f"\n{Fore.CYAN}Report di compressione:")
     for file_info in files_info:
-        filename, initial_size, final_size, compression_ratio = file_info
+        filename, initial_size, final_size, compression_ratio, stats = file_info
         print(f"{Fore.GREEN}{filename}")
         print(f"{Fore.CYAN}Dimensioni iniziali: {initial_size / (1024 * 1024):.2f} MB, "
               f"Dimensioni finali: {final_size / (1024 * 1024):.2f} MB, "
               f"Rapporto di compressione: {compression_ratio:.2f}%")
+        print(f"{Fore.CYAN}Immagini ricompresse: {stats['recompressed']}/{stats['images']}, "
+              f"Risparmio sulle immagini: {stats['saved_bytes'] / (1024 * 1024):.2f} MB")
+        if stats['metadata']:
+            print(f"{Fore.CYAN}Metadati rimossi: {format_metadata_savings(stats['metadata'])}")
+        if stats['fonts']:
+            print(f"{Fore.CYAN}Font ridotti: {stats['subset_fonts']}/{stats['fonts']}, "
+                  f"Risparmio sui font: {stats['font_saved_bytes'] / (1024 * 1024):.2f} MB")
+        if stats['minified']:
+            print(f"{Fore.CYAN}XHTML e CSS minificati: {stats['minified']}, "
+                  f"Risparmio sul testo: {stats['minify_saved_bytes'] / 1024:.1f} KB")
+        if stats['orphans']:
+            outcome = "rimosse" if stats['pruned'] else "lasciate nell'EPUB"
+            print(f"{Fore.CYAN}Risorse non referenziate: {stats['orphans']} "
+                  f"({stats['orphan_bytes'] / 1024:.1f} KB), {outcome}")
+        if stats['duplicates']:
+            print(f"{Fore.CYAN}Immagini duplicate eliminate: {stats['duplicates']} "
+                  f"({stats['duplicate_bytes'] / 1024:.1f} KB)")
         print(f"{Fore.CYAN}{'-' * 70}")
 
+    # Totali del batch
+    if len(files_info) > 1:
+        total_initial = sum(file_info[1] for file_info in files_info)
+        total_final = sum(file_info[2] for file_info in files_info)
+        total_saved = sum(file_info[4]['saved_bytes'] for file_info in files_info)
+        total_ratio = (total_initial - total_final) / total_initial * 100 if total_initial > 0 else 0
+        print(f"{Fore.GREEN}Totale ({len(files_info)} file)")
+        print(f"{Fore.CYAN}Dimensioni iniziali: {total_initial / (1024 * 1024):.2f} MB, "
+              f"Dimensioni finali: {total_final / (1024 * 1024):.2f} MB, "
+              f"Rapporto di compressione: {total_ratio:.2f}%")
+        print(f"{Fore.CYAN}Risparmio sulle immagini: {total_saved / (1024 * 1024):.2f} MB")
+        total_metadata = {}
+        for file_info in files_info:
+            for category, size in file_info[4]['metadata'].items():
+                add_saving(total_metadata, category, size)
+        if total_metadata:
+            print(f"{Fore.CYAN}Metadati rimossi: {format_metadata_savings(total_metadata)}")
+        if any(file_info[4]['fonts'] for file_info in files_info):
+            total_font_saved = sum(file_info[4]['font_saved_bytes'] for file_info in files_info)
+            print(f"{Fore.CYAN}Risparmio sui font: {total_font_saved / (1024 * 1024):.2f} MB")
+
 # Parsing degli argomenti da linea di comando
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Comprimere immagini all'interno di file EPUB.")
@@ -105,23 +2379,143 @@ if __name__ == "__main__":
                         help="Comprime tutti i file EPUB nella directory corrente.")
     parser.add_argument("epub_file", nargs="?", default=None,
                         help="Il percorso del file EPUB da comprimere (ignorato se -f è specificato).")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Numero di processi per la compressione delle immagini (default: 1).")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Numero di EPUB da comprimere contemporaneamente con -f (default: 1).")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Directory della cache delle immagini compresse (disattivata se non specificata).")
+    parser.add_argument("--cache-max-mb", type=int, default=1024,
+                        help="Dimensione massima della cache in MB (default: 1024).")
+    parser.add_argument("--zip-level", type=int, default=None,
+                        help="Livello di compressione deflate dell'EPUB (1-9); se indicato anche i membri "
+                             "invariati vengono ricompressi quando occupano meno spazio.")
+    parser.add_argument("--zip-backend", choices=ZIP_BACKENDS, default="zlib",
+                        help="Backend deflate: zlib, zlib-ng o isal (più veloci), zopfli (compressione "
+                             "massima, molto lenta, per le versioni finali) (default: zlib).")
+    parser.add_argument("--min-saving", type=float, default=0,
+                        help="Risparmio minimo in percentuale per sostituire un'immagine (default: 0).")
+    parser.add_argument("--target-kb", type=float, default=None,
+                        help="Dimensione massima in KB di ogni JPEG; la qualità indicata diventa il massimo.")
+    parser.add_argument("--target-ratio", type=float, default=None,
+                        help="Dimensione massima di ogni JPEG come frazione dell'originale (es. 0.5).")
+    parser.add_argument("--min-ssim", type=float, default=None,
+                        help="Somiglianza percettiva minima (SSIM, 0-1) per scegliere la qualità JPEG più bassa.")
+    parser.add_argument("--max-width", type=int, default=None,
+                        help="Larghezza massima in pixel delle immagini; le più grandi vengono ridotte.")
+    parser.add_argument("--max-height", type=int, default=None,
+                        help="Altezza massima in pixel delle immagini; le più grandi vengono ridotte.")
+    parser.add_argument("--max-pixels", type=int, default=None,
+                        help="Numero massimo di pixel delle immagini; le più grandi vengono ridotte.")
+    parser.add_argument("--resample", choices=sorted(RESAMPLE_FILTERS), default="lanczos",
+                        help="Filtro di ridimensionamento (default: lanczos).")
+    parser.add_argument("--max-memory-mb", type=int, default=None,
+                        help="Memoria massima in MB per decodificare un'immagine in ogni processo; "
+                             "le immagini più grandi restano invariate.")
+    parser.add_argument("--convert-to", choices=MODERN_FORMATS, default=None,
+                        help="Converte le immagini in WebP o AVIF (solo negli EPUB 3), aggiornando manifest "
+                             "e riferimenti in XHTML e CSS.")
+    parser.add_argument("--png-to-jpeg", action="store_true",
+                        help="Converte in JPEG i PNG fotografici opachi, rinominandoli e aggiornando "
+                             "manifest e riferimenti in XHTML e CSS.")
+    parser.add_argument("--classify", action="store_true",
+                        help="Sceglie l'encoder dal contenuto e non dall'estensione: le foto diventano "
+                             "JPEG (o WebP/AVIF con perdita), la grafica e il testo PNG con palette.")
+    parser.add_argument("--jpeg-lossless", action="store_true",
+                        help="Ottimizza i JPEG senza perdita (Huffman ottimizzato, senza metadati) invece di "
+                             "ricodificarli; senza jpegtran vengono solo rimossi i metadati.")
+    parser.add_argument("--jpeg-progressive", action="store_true",
+                        help="Con --jpeg-lossless salva i JPEG in modalità progressiva; richiede jpegtran.")
+    parser.add_argument("--force-reencode", action="store_true",
+                        help="Ricodifica anche i JPEG già salvati a una qualità pari o inferiore a quella indicata.")
+    parser.add_argument("--strip-metadata", action="store_true",
+                        help="Rimuove dalle immagini EXIF, XMP, testo, commenti e miniature anche quando "
+                             "non vengono ricodificate, riportando i byte risparmiati per categoria.")
+    parser.add_argument("--icc", choices=ICC_POLICIES, default="srgb",
+                        help="Profili ICC: srgb mantiene quelli sRGB e converte in sRGB le immagini "
+                             "ricodificate con altri profili, keep li mantiene, strip li elimina (default: srgb).")
+    parser.add_argument("--subset-fonts", action="store_true",
+                        help="Riduce i font incorporati ai caratteri usati nel testo, per famiglia "
+                             "dichiarata nei CSS, anche se offuscati (IDPF o Adobe); richiede fontTools.")
+    parser.add_argument("--minify", action="store_true",
+                        help="Minifica XHTML e CSS: commenti rimossi, spazi ridotti fuori da <pre> "
+                             "e dichiarazioni CSS duplicate o abbreviabili semplificate.")
+    parser.add_argument("--prune", choices=('report', 'drop'), default=None,
+                        help="Risorse (immagini, font, CSS, audio, video) non raggiungibili da OPF, spine "
+                             "e documenti: report le elenca, drop le elimina insieme alle voci del manifest.")
+    parser.add_argument("--dedup", choices=('exact', 'perceptual'), default=None,
+                        help="Sostituisce le immagini duplicate con un'unica copia, aggiornando manifest e "
+                             "riferimenti: exact solo le copie identiche, perceptual anche quelle quasi "
+                             "uguali per hash percettivo.")
+    parser.add_argument("--png-max-error", type=float, default=None,
+                        help="Errore medio massimo per canale (0-255) nella scelta della palette PNG "
+                             "più piccola; senza questa opzione la palette è stimata dall'entropia dei colori.")
     args = parser.parse_args()
 
     output_dir = "compressed"
     files_info = []
+    image_options = {
+        'quality': args.quality,
+        'min_saving': args.min_saving,
+        'target_kb': args.target_kb,
+        'target_ratio': args.target_ratio,
+        'min_ssim': args.min_ssim,
+        'max_width': args.max_width,
+        'max_height': args.max_height,
+        'max_pixels': args.max_pixels,
+        'resample': args.resample,
+        'max_memory_mb': args.max_memory_mb,
+        'png_max_error': args.png_max_error,
+        'convert_to': args.convert_to,
+        'png_to_jpeg': args.png_to_jpeg,
+        'classify': args.classify,
+        'jpeg_lossless': args.jpeg_lossless,
+        'jpeg_progressive': args.jpeg_progressive,
+        'force_reencode': args.force_reencode,
+        'strip_metadata': args.strip_metadata,
+        'icc_policy': args.icc,
+    }
+    cache = ImageCache(args.cache_dir, args.cache_max_mb * 1024 * 1024) if args.cache_dir else None
 
     if not (1 <= args.quality <= 100):
         print(f"{Fore.RED}Errore: La qualità deve essere un valore tra 1 e 100.")
+    elif args.workers < 1:
+        print(f"{Fore.RED}Errore: Il numero di processi deve essere almeno 1.")
+    elif args.jobs < 1:
+        print(f"{Fore.RED}Errore: Il numero di EPUB in parallelo deve essere almeno 1.")
+    elif args.zip_level is not None and not (1 <= args.zip_level <= 9):
+        print(f"{Fore.RED}Errore: Il livello di compressione dell'EPUB deve essere un valore tra 1 e 9.")
+    elif not zip_backend_available(args.zip_backend):
+        print(f"{Fore.RED}Errore: Il backend {args.zip_backend} non è installato.")
+    elif args.jpeg_lossless and args.jpeg_progressive and not shutil.which("jpegtran"):
+        print(f"{Fore.RED}Errore: --jpeg-progressive richiede jpegtran, che non è installato.")
+    elif not (0 <= args.min_saving < 100):
+        print(f"{Fore.RED}Errore: Il risparmio minimo deve essere un valore tra 0 e 100.")
+    elif args.target_kb is not None and args.target_kb <= 0:
+        print(f"{Fore.RED}Errore: La dimensione obiettivo deve essere maggiore di 0.")
+    elif args.target_ratio is not None and not (0 < args.target_ratio <= 1):
+        print(f"{Fore.RED}Errore: Il rapporto obiettivo deve essere un valore tra 0 e 1.")
+    elif args.min_ssim is not None and not (0 < args.min_ssim <= 1):
+        print(f"{Fore.RED}Errore: La SSIM minima deve essere un valore tra 0 e 1.")
+    elif any(limit is not None and limit < 1 for limit in (args.max_width, args.max_height, args.max_pixels)):
+        print(f"{Fore.RED}Errore: Le dimensioni massime devono essere maggiori di 0.")
+    elif args.max_memory_mb is not None and args.max_memory_mb < 1:
+        print(f"{Fore.RED}Errore: La memoria massima deve essere almeno 1 MB.")
+    elif args.png_max_error is not None and args.png_max_error < 0:
+        print(f"{Fore.RED}Errore: L'errore massimo per i PNG non può essere negativo.")
+    elif args.subset_fonts and font_subset is None:
+        print(f"{Fore.RED}Errore: La riduzione dei font richiede fontTools (pip install fonttools).")
+    elif args.convert_to and not features.check(args.convert_to):
+        print(f"{Fore.RED}Errore: La versione di Pillow installata non supporta il formato {args.convert_to}.")
     elif args.all_files:
         epub_files = [f for f in os.listdir('.') if f.lower().endswith('.epub')]
         if not epub_files:
             print(f"{Fore.RED}Nessun file EPUB trovato nella directory corrente.")
         else:
             print(f"{Fore.GREEN}Trovati {len(epub_files)} file EPUB. Inizio compressione...")
-            for epub_file in epub_files:
-                file_info = compress_epub(epub_file, args.quality, output_dir)
-                if file_info:
-                    files_info.append(file_info)
+            files_info = compress_epubs(epub_files, image_options, output_dir, args.workers, args.jobs, cache,
+                                        args.zip_level, args.zip_backend, args.subset_fonts, args.minify,
+                                        args.prune, args.dedup)
             print_report(files_info)
     elif args.epub_file:
         if not os.path.isfile(args.epub_file):
@@ -129,7 +2523,12 @@ if __name__ == "__main__":
         elif not args.epub_file.lower().endswith('.epub'):
             print(f"{Fore.RED}Errore: Il file specificato non è un EPUB.")
         else:
-            file_info = compress_epub(args.epub_file, args.quality, output_dir)
+            file_info = compress_epub(args.epub_file, image_options, output_dir, args.workers, cache=cache,
+                                      zip_level=args.zip_level, zip_backend=args.zip_backend,
+                                      subset_fonts=args.subset_fonts, minify=args.minify, prune=args.prune,
+                                      dedup=args.dedup)
+            if cache:
+                cache.evict()
             if file_info:
                 files_info.append(file_info)
             print_report(files_info)